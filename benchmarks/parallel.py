@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracking.config import loadConfig
+from tracking.frames import openSource
+from tracking.pipeline import DetectionPipeline
+
+
+def measure(source, config, workers, repeat):
+    best = None
+    for _ in range(repeat):
+        pipeline = DetectionPipeline(config, workers=workers)
+        start = time.perf_counter()
+        frames = sum(1 for _ in pipeline.process(source))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return frames / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Frames per second of the detection pipeline against the number of 2D workers.')
+    parser.add_argument('input', nargs='?', default='dataset/latest')
+    parser.add_argument('-c', '--config', default='config/config.json')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', help='worker counts to measure')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per worker count, the best one is reported')
+    args = parser.parse_args(argv)
+
+    config = loadConfig(args.config)
+    # decoded to grayscale like the worker processes do, so every row pays the same decoding
+    source = openSource(args.input, grayscale=True)
+    workers = args.workers
+    if not workers:
+        workers = [1]
+        while workers[-1] * 2 <= os.cpu_count():
+            workers.append(workers[-1] * 2)
+
+    print(f"{args.input}: {len(source)} frames, {os.cpu_count()} cpus")
+    print(f"{'workers':>8} {'fps':>10} {'speedup':>8}")
+    baseline = None
+    for count in workers:
+        fps = measure(source, config, count, args.repeat)
+        baseline = baseline or fps
+        print(f"{count:>8} {fps:>10.1f} {fps / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
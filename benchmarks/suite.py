@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracking.config import loadConfig
+from tracking.frames import openSource
+from tracking.pipeline import DetectionPipeline
+from tracking.samples import GazeSamples
+from tracking.timing import StageTimer
+
+# camera of the synthetic renders without glints, Geometry has the one of dataset/latest
+SYNTHETIC_CAMERA = ([0, -50, 0], [[1, 0, 0], [0, 0, 1], [0, -1, 0]])
+
+DATASETS = {
+    'latest': ('dataset/latest', None),
+    'synthetizedImages': ('dataset/synthetizedImages', None),
+    'synthetizedImages_no_glint_denoised': ('dataset/synthetizedImages_no_glint_denoised', SYNTHETIC_CAMERA),
+    'synthetizedImages_y_offset_only': ('dataset/synthetizedImages_y_offset_only', SYNTHETIC_CAMERA),
+}
+
+# relative slowdown / growth allowed before a run counts as a regression
+TOLERANCE = {"fps": 0.15, "p95_ms": 0.25, "peak_rss_mb": 0.15, "distance_mm": 1.0}
+
+
+def groundTruth():
+    # same 11x11 grid on the 250x250 display as utils/eval.py
+    return np.array([(x, -500, z) for x in range(125, -126, -25) for z in range(-125, 126, 25)], dtype=float)
+
+
+def peakRss():
+    # megabytes, resource is not available on Windows
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                 ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize / 1024 ** 2
+
+
+def accuracy(pipeline, samples):
+    # display points in the ground truth frame, outliers dropped with the thresholds of utils/eval.py
+    count = min(len(samples), len(groundTruth()))
+    truth = groundTruth()[:count]
+    uv = pipeline.pointsToUV(pipeline.transform(samples.display[:count], pipeline.displayPos, pipeline.displayRotMat))
+    hit = ~np.isnan(uv[:, 0])
+    truth, uv = truth[hit], uv[hit]
+    points = np.column_stack((uv[:, 0] * pipeline.displaySize[0] - pipeline.displaySize[0] / 2, np.full(len(uv), -500.0),
+                              (1 - uv[:, 1]) * pipeline.displaySize[1] - pipeline.displaySize[1] / 2))
+
+    distances = np.hypot(points[:, 0] - truth[:, 0], points[:, 2] - truth[:, 2])
+    distances = distances[distances < 75]
+    cosines = (points * truth).sum(axis=1) / (np.linalg.norm(points, axis=1) * np.linalg.norm(truth, axis=1))
+    angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+    angles = angles[angles < 10]
+
+    return {"distance_mm": float(distances.mean()) if len(distances) else None,
+            "accuracy_deg": float(angles.mean()) if len(angles) else None,
+            "inliers": len(distances)}
+
+
+def benchmarkDataset(path, camera, configPath, workers, repeat):
+    config = loadConfig(configPath)
+    best = None
+    for _ in range(repeat):
+        pipeline = DetectionPipeline(config, workers=workers)
+        if camera is not None:
+            pipeline.cameraPos = np.array(camera[0])
+            pipeline.cameraRotMat = np.array(camera[1], dtype=float)
+        source = openSource(path, grayscale=True, prefetch=8)
+
+        # latency of every frame in the detection pass, the recorded pass replays its 2D results
+        frameTimer = StageTimer()
+        datums = []
+        start = time.perf_counter()
+        for _ in frameTimer.iterate(pipeline.process(source, datums), 'frame'):
+            pass
+        samples = GazeSamples()
+        for sample in pipeline.replay(datums):
+            samples.append(*sample)
+        elapsed = time.perf_counter() - start
+
+        latency = frameTimer.summary()['frame']
+        result = {"frames": len(samples), "fps": len(samples) / elapsed,
+                  "p50_ms": latency["p50"], "p95_ms": latency["p95"], "p99_ms": latency["p99"],
+                  "stages": {stage: values["p50"] for stage, values in pipeline.timer.summary().items()}}
+        if best is None or result["fps"] > best["fps"]:
+            best = result
+            best.update(accuracy(pipeline, samples))
+
+    best["peak_rss_mb"] = peakRss()
+    return best
+
+
+def regressions(name, result, baseline):
+    found = []
+    if result["fps"] < baseline["fps"] * (1 - TOLERANCE["fps"]):
+        found.append(f"{name}: {result['fps']:.1f} fps, baseline {baseline['fps']:.1f}")
+    for key in ("p95_ms", "peak_rss_mb"):
+        if result[key] > baseline[key] * (1 + TOLERANCE[key]):
+            found.append(f"{name}: {key} {result[key]:.2f}, baseline {baseline[key]:.2f}")
+    if baseline["distance_mm"] is not None and (result["distance_mm"] is None or
+                                                result["distance_mm"] > baseline["distance_mm"] + TOLERANCE["distance_mm"]):
+        found.append(f"{name}: gaze error {result['distance_mm']} mm, baseline {baseline['distance_mm']:.2f} mm")
+    if result["inliers"] < baseline["inliers"]:
+        found.append(f"{name}: {result['inliers']} frames within 75 mm, baseline {baseline['inliers']}")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput, latency, memory and gaze accuracy of the pipeline on the bundled datasets.')
+    parser.add_argument('datasets', nargs='*', help='datasets to run, all by default: ' + ', '.join(DATASETS))
+    parser.add_argument('-c', '--config', default='config/config.json')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='processes for the 2D detection')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per dataset, the fastest one is reported')
+    parser.add_argument('-b', '--baseline', default='benchmarks/baseline.json', help='stored results to compare against')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='replace the baseline with this run')
+    args = parser.parse_args(argv)
+    for name in args.datasets:
+        if name not in DATASETS:
+            parser.error(f"unknown dataset '{name}'")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'dataset':<38}{'fps':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'rss MB':>9}{'mm':>8}{'deg':>7}{'in':>5}")
+    for name in args.datasets or DATASETS:
+        path, camera = DATASETS[name]
+        # a fresh process for every dataset, otherwise the peak RSS would carry over
+        with ProcessPoolExecutor(1) as pool:
+            result = pool.submit(benchmarkDataset, path, camera, args.config, args.workers, args.repeat).result()
+        results[name] = result
+        distance = f"{result['distance_mm']:.2f}" if result['distance_mm'] is not None else '-'
+        degree = f"{result['accuracy_deg']:.2f}" if result['accuracy_deg'] is not None else '-'
+        print(f"{name:<38}{result['fps']:>8.1f}{result['p50_ms']:>8.2f}{result['p95_ms']:>8.2f}{result['p99_ms']:>8.2f}"
+              f"{result['peak_rss_mb']:>9.1f}{distance:>8}{degree:>7}{result['inliers']:>5}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    found = []
+    for name, result in results.items():
+        if name in baseline:
+            found += regressions(name, result, baseline[name])
+    for line in found:
+        print("REGRESSION " + line)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+from tracking.config import loadConfig
+from tracking.frames import openSource
+from tracking.pipeline import DetectionPipeline, SAMPLE_HEADER
+from tracking.samples import GazeSamples
+from tracking.session import SESSION_EXTENSION, SessionWriter
+
+
+def detectRecording(path, config, outputPath, warmup=True, workers=1, prefetch=8, cache=False, resultCache=False,
+                    tracking=False, timingsPath=None, sessionPath=None):
+    pipeline = DetectionPipeline(config, workers=workers, cache=resultCache, tracking=tracking)
+    source = openSource(path, grayscale=True, prefetch=prefetch, cache=cache)
+    samples = GazeSamples()
+    session = SessionWriter(sessionPath, config, pipeline, source=os.path.abspath(path)) if sessionPath else None
+    start = time.perf_counter()
+    try:
+        with open(outputPath, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(SAMPLE_HEADER)
+            for sample in pipeline.run(source, warmup=warmup):
+                writer.writerow(pipeline.sampleRow(*sample))
+                samples.append(*sample)
+                if session is not None:
+                    session.write(samples)
+    except BaseException:
+        # an existing session of the recording stays as it was
+        if session is not None:
+            session.discard()
+        raise
+    if session is not None:
+        session.close(samples)
+    frames = len(samples)
+    elapsed = time.perf_counter() - start
+    if timingsPath:
+        pipeline.timer.save(timingsPath)
+    return frames, elapsed
+
+
+def outputNames(paths):
+    # output names from the input names, inputs whose names collide are named by their path below the common root
+    paths = [os.path.abspath(path) for path in paths]
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    root = os.path.commonpath(paths) if paths else ''
+    return [os.path.relpath(path, root).replace(os.sep, '_') if names.count(name) > 1 else name
+            for path, name in zip(paths, names)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run pupil detection and gaze projection without the GUI.')
+    parser.add_argument('inputs', nargs='+', help='frame folders, first frames (prefix_<i>.png) or eye videos')
+    parser.add_argument('-c', '--config', default='config/config.json', help='detector configuration')
+    parser.add_argument('-o', '--output', default='output', help='folder for the gaze sample CSV files')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='processes for the 2D detection')
+    parser.add_argument('--prefetch', type=int, default=8, help='frames decoded ahead of the detection, 0 disables it')
+    parser.add_argument('--cache', action='store_true', help='keep the decoded frames of a folder in a memory-mapped cache')
+    parser.add_argument('--result-cache', action='store_true', help='reuse 2D results of frames already detected with the same detector_2d config')
+    parser.add_argument('--track', action='store_true', help='search the pupil around its last position before the whole frame')
+    parser.add_argument('--timings', action='store_true', help='write p50/p95/p99 latencies of every stage to <name>.timings.json')
+    parser.add_argument('--session', action='store_true', help='also save the samples, config and geometry to <name>.session')
+    parser.add_argument('--no-warmup', action='store_true', help='skip the eye model warm-up pass')
+    args = parser.parse_args(argv)
+
+    names = outputNames(args.inputs)
+    if len(set(names)) < len(names):
+        parser.error("some inputs would write to the same output files, is one of them given twice?")
+
+    config = loadConfig(args.config)
+    os.makedirs(args.output, exist_ok=True)
+
+    failed = 0
+    for path, name in zip(args.inputs, names):
+        outputPath = os.path.join(args.output, name + '.csv')
+        timingsPath = os.path.join(args.output, name + '.timings.json') if args.timings else None
+        sessionPath = os.path.join(args.output, name + SESSION_EXTENSION) if args.session else None
+        try:
+            frames, elapsed = detectRecording(path, config, outputPath, warmup=not args.no_warmup,
+                                             workers=args.workers, prefetch=args.prefetch, cache=args.cache,
+                                             resultCache=args.result_cache, tracking=args.track,
+                                             timingsPath=timingsPath, sessionPath=sessionPath)
+        except Exception as e:
+            # a broken recording (unreadable frame, bad video, ...) does not stop the rest of the batch
+            print(f"{path}: {type(e).__name__}: {e}", file=sys.stderr)
+            # partial results would pass for complete ones
+            for partialPath in (outputPath, timingsPath):
+                if partialPath and os.path.exists(partialPath):
+                    os.remove(partialPath)
+            failed += 1
+            continue
+        print(f"{path}: {frames} frames in {elapsed:.2f}s ({frames / max(elapsed, 1e-9):.1f} fps) -> {outputPath}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
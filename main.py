@@ -1,71 +1,50 @@
 import sys
 import os
-import glob
 import cv2
 import re
 import json
 import numpy as np
 import csv
+import time
+from threading import Thread
 
-from math import sqrt, atan2, cos, sin
 
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtGui import QPixmap, QImage, QRegularExpressionValidator
-from PySide6.QtCore import QFile, QRegularExpression, Qt, QCoreApplication, QObject
+from PySide6.QtCore import QFile, QRegularExpression, Qt, QCoreApplication, QObject, QThread, QTimer, Signal
 from PySide6.QtWidgets import QApplication, QFileDialog, QLabel, QPushButton, QWidget, QButtonGroup, QColorDialog, QVBoxLayout
 from pyqt_frameless_window import FramelessMainWindow
 
 from pupil_detectors import Detector2D
-from pye3d.detector_3d import CameraModel, Detector3D, DetectorMode
-
-from scipy.spatial.transform import Rotation
+from scipy.spatial import cKDTree
+
+from tracking.calibration import fitCalibration
+from tracking.config import detector2dConfig, detector3dConfig
+from tracking.fixations import DEFAULT_DISPERSION, MAX_DISPERSION, MIN_FIXATION_DURATION, DispersionLevels
+from tracking.frames import openSource, timestampRate
+from tracking.geometry import Geometry
+from tracking.heatmap import HeatmapAccumulator, overlayHeatmap
+from tracking.layers import Layer, LayerCompositor
+from tracking.pipeline import DetectionPipeline
+from tracking.samples import GazeSamples
+from tracking.session import SESSION_EXTENSION, SessionWriter, appendRecord, loadSession
+from tracking.tiles import HeatmapTiles, StimulusPyramid, isLargeImage
 
 from matplotlib import pyplot, use
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection, Text3D
 use('Agg')
 
 
-class GlobalSharedClass():
+class GlobalSharedClass(Geometry):
     # TODO: Singleton
     _instance = None
 
     def __init__(self):
+        Geometry.__init__(self)
+
         # UI LoadercameraPos
         self.loader = QUiLoader()
 
-        # Constants
-        self.planeNormal = np.array([0, 1, 0])
-        self.planeCenter = np.array([0, -500, 0])
-        self.planeRot = np.array([0, 0, 180])
-
-        # for latest dataset
-        self.cameraPos = np.array([20, -50, -10])
-        self.cameraRotMat = np.array([
-            [0.884918212890625, -0.105633445084095, -0.4536091983318329],
-            [0.4657464325428009, 0.20070354640483856, 0.8618574738502502],
-            [0.0, -0.973940372467041, 0.22680459916591644]
-        ])
-
-        # for synthetizedImages_no_glint_denoised dataset
-        # self.cameraPos = np.array([0, -50, 0])
-        # self.cameraRotMat = np.array([
-        #     [1, 0, 0],
-        #     [0, 0, 1],
-        #     [0, 1, 0]
-        # ])
-        
-        self.displaySize = (250, 250) #width, height
-        self.displayPos = np.array([0, -500, 0])
-        self.displayRot = np.array([0, 0, 180])
-        self.displayRotMat = self.eulerToRot(self.displayRot)
-        self.displayNormalLocal = np.array([0, -1, 0])
-        self.displayNormalWorld = self.normalize(self.rotate(self.displayNormalLocal, self.displayRotMat))
-        self.cameraDirsWorld = (
-            self.rotate(np.array((1, 0, 0)), self.cameraRotMat),
-            self.rotate(np.array((0, 1, 0)), self.cameraRotMat),
-            self.rotate(np.array((0, 0, 1)), self.cameraRotMat)
-        )
-
         # Validators
         self.radiusRegex = QRegularExpression("^[1-9][0-9]?$|^100$")
         self.floatingRegex = QRegularExpression("^(0|[1-9]\\d*)(\\.\\d+)?$")
@@ -73,130 +52,120 @@ class GlobalSharedClass():
         self.boolRegex = QRegularExpression("^True|False$")
         self.detectorModeRegex = QRegularExpression("^blocking|asynchronous$")
         self.graphParamRegex = QRegularExpression("^([0-9]|[1-9][0-9]|1[0-9][0-9]|2[0-9][0-9]|3[0-5][0-9]|360)$")
-        self.thresholdRegex = QRegularExpression("^(1?\d{1,2}|2[0-4]\d|25[0-5])$")
-
-    def distance(self, p1, p2):
-        return sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
+        # scanpath dispersion in pixels, 0 to MAX_DISPERSION
+        self.thresholdRegex = QRegularExpression("^(\d{1,2}|[1-4]\d{2}|500)$")
 
-    def dir_vector(self, vec1, vec2):
-        return [vec2[0] - vec1[0], vec2[1] - vec1[1], vec2[2] - vec1[2]]
-
-    def lookAt(self, camera, target, up):
-        forward = target - camera
-        forward = forward / np.linalg.norm(forward)
-
-        right = np.cross(forward, up)
-        right = right / np.linalg.norm(right)
+    def setupTitleBar(self, outerClass):
+        outerClass.getTitleBar().setFixedHeight(35)
+        for button in outerClass.getTitleBar().findChildren(QPushButton):
+            button.setStyleSheet("QPushButton {background-color: #FFE81F; border-radius: 7px; margin-right: 15px; width: 25px; height: 25px} QPushButton:hover {background-color: #ccba18; border-radius: 7px; margin-right: 15px; width: 25px; height: 25px} QPushButton:pressed {background-color: #ccba18; border-radius: 7px; margin-right: 15px; width: 25px; height: 25px}")
+        outerClass.getTitleBar().findChildren(QLabel)[1].setStyleSheet("QLabel {font-size: 15px; color: #F7FAFC; font-weight: bold; margin-left: 10px}")
+        outerClass.getTitleBar().findChildren(QLabel)[0].setStyleSheet("QLabel {margin-left: 10px}")
 
-        new_up = np.cross(right, forward)
+class DetectionWorker(QThread):
+    frameReady = Signal(int, object)
+    resultReady = Signal(int, float, object, object, bool)
+    progress = Signal(int, int)
 
-        result = np.identity(4)
-        result[0][0] = right[0]
-        result[0][1] = right[1]
-        result[0][2] = right[2]
+    def __init__(self, pipeline, source, warmup, imageFlag, datums=None):
+        super().__init__()
+        self.pipeline = pipeline
+        self.source = source
+        self.warmup = warmup
+        self.imageFlag = imageFlag
+        self.datums = datums
+        self.cancelled = False
+        # stays False when the run is cancelled or raises
+        self.completed = False
+        self.done = 0
+
+    def run(self):
+        self.completed = self.detectRounds()
+
+    def detectRounds(self):
+        replaying = self.datums is not None
+        self.total = (2 if self.warmup else 1) * len(self.datums if replaying else self.source)
+        if not replaying:
+            self.datums = []
+            if not self.detectFrames():
+                return False
+            if not self.warmup:
+                return True
+        elif self.warmup:
+            # only 3D parameters changed, the eye model warms up on the 2D results of the last run
+            if not self.replayDatums(provisional=True):
+                return False
+
+        # the warm-up round trains the eye model and its samples are only provisional,
+        # the recorded round replays its 2D results and replaces them
+        return self.replayDatums(provisional=False)
+
+    def detectFrames(self):
+        self.pipeline.startPass(self.source)
+        for i, timestamp, image in self.pipeline.timer.iterate(self.source):
+            if self.isInterruptionRequested():
+                self.cancelled = True
+                return False
+
+            grayscale_array = self.pipeline.grayscale(image)
+            if self.imageFlag == "2D" or self.imageFlag == "Simple":
+                image = cv2.cvtColor(grayscale_array, cv2.COLOR_GRAY2BGR)
 
-        result[1][0] = new_up[0]
-        result[1][1] = new_up[1]
-        result[1][2] = new_up[2]
+            if self.imageFlag == "2D":
+                result_2d = self.pipeline.detect2d(grayscale_array, image)
 
-        result[2][0] = -forward[0]
-        result[2][1] = -forward[1]
-        result[2][2] = -forward[2]
+            elif self.imageFlag == "Simple":
+                result_2d = self.pipeline.detect2d(grayscale_array)
+                cv2.ellipse(
+                    image,
+                    tuple(int(v) for v in result_2d["ellipse"]["center"]),
+                    tuple(int(v / 2) for v in result_2d["ellipse"]["axes"]),
+                    result_2d["ellipse"]["angle"],
+                    0,
+                    360,
+                    (0, 255, 0),
+                )
+            else:
+                result_2d = self.pipeline.detect2d(grayscale_array)
 
-        translation = np.identity(4)
-        translation[0][3] = -camera[0]
-        translation[1][3] = -camera[1]
-        translation[2][3] = -camera[2]
+            self.datums.append(self.pipeline.datum(i, timestamp, result_2d, grayscale_array, self.source))
+            self.emitResult(*self.pipeline.finish3d(i, timestamp, result_2d, grayscale_array), provisional=self.warmup)
 
-        lookAt_matrix = np.matmul(result, translation)
-        # Extract the rotation submatrix from the look-at matrix
-        rot_matrix = lookAt_matrix[:3, :3]
-        
-        # Convert the rotation to Euler angles using the zxy convention
-        theta_z = np.arctan2(-rot_matrix[0, 1], rot_matrix[0, 0])
-        theta_x = np.arctan2(-rot_matrix[1, 2], rot_matrix[2, 2])
-        theta_y = np.arcsin(rot_matrix[0, 2])
+            self.frameReady.emit(i, image)
+            self.step()
 
-        # Convert the angles to degrees and print the result
-        euler_angles = np.array([theta_x, theta_y, theta_z]) * 180 / np.pi
+        self.pipeline.saveResults()
+        return True
 
-        return euler_angles
+    def replayDatums(self, provisional):
+        for datum in self.datums:
+            if self.isInterruptionRequested():
+                self.cancelled = True
+                return False
 
+            self.emitResult(*self.pipeline.finish3d(*datum), provisional=provisional)
+            self.step()
+        return True
 
-    def transform(self, p, position, rotMat):
-        return self.rotate(p, rotMat) + position
-    
-    def inverseTransform(self, p, position, rotMat):
-        return (p - position) @ rotMat #inverse rotation
-        
-    def rotate(self, p, rotMat):
-        return p @ rotMat.T
-
-    def transfer_vector(self, vec, position, rotation):
-        return vec @ self.eulerToRot(rotation) + position
-
-    def eulerToRot(self, theta, degrees=True) :
-        r = Rotation.from_euler("zxy", (theta[2], theta[0], theta[1]), degrees)
-        return r.as_matrix()
-
-    def intersectPlane(self, n, p0, l0, l):
-        denom = self.matmul(-n, l)
-        if (denom > sys.float_info.min):
-            p0l0 = p0 - l0
-            t = self.matmul(p0l0, -n) / denom
-            return t
-        return -1.0
-            
-    def matmul(self, v1, v2, pad=False, padBy=1.0):
-        if(pad is True):
-            return np.matmul(v1, np.append(v2, padBy))[:-1]
-        return np.matmul(v1, v2)
-        
-    def getPoint(self, ray, distance):
-        return ray[0] + ray[1] * distance
+    def step(self):
+        self.done += 1
+        self.progress.emit(self.done, self.total)
 
-    def normalize(self, v):
-        return v / self.magnitude(v)
-        
-    def magnitude(self, v):
-        return np.sqrt(self.sqrMagnitude(v))
-            
-    def sqrMagnitude(self, v):
-        return self.matmul(v, v)
-    
-    def lerp(self, a, b, t):
-        return (1 - t) * a + t * b
-
-    def convert_uv_to_px(self, uv_data, width, height):
-        return (int(uv_data[0] * width), int(uv_data[1] * height))
-
-    def convert_to_uv(self, vec, size_x=250, size_y=250, flip_y=True, includeOutliers=False):
-        x = (vec[0] + size_x / 2) / size_x
-        y = (vec[2] + size_y / 2) / size_y
-        if flip_y:
-            y = 1 - y
-
-        if not includeOutliers:
-            if x < 0 or x > 1 or y < 0 or y > 1:
-                return None
-        return (x, y)
-    
-    def setupTitleBar(self, outerClass):
-        outerClass.getTitleBar().setFixedHeight(35)
-        for button in outerClass.getTitleBar().findChildren(QPushButton):
-            button.setStyleSheet("QPushButton {background-color: #FFE81F; border-radius: 7px; margin-right: 15px; width: 25px; height: 25px} QPushButton:hover {background-color: #ccba18; border-radius: 7px; margin-right: 15px; width: 25px; height: 25px} QPushButton:pressed {background-color: #ccba18; border-radius: 7px; margin-right: 15px; width: 25px; height: 25px}")
-        outerClass.getTitleBar().findChildren(QLabel)[1].setStyleSheet("QLabel {font-size: 15px; color: #F7FAFC; font-weight: bold; margin-left: 10px}")
-        outerClass.getTitleBar().findChildren(QLabel)[0].setStyleSheet("QLabel {margin-left: 10px}")
+    def emitResult(self, i, timestamp, result_3d, planeIntersection, provisional=False):
+        # a ray missing the display is stored as NaN
+        if planeIntersection is None:
+            planeIntersection = np.full(3, np.nan)
+        self.resultReady.emit(i, timestamp, result_3d, planeIntersection, provisional)
 
 class MainWindow(FramelessMainWindow, GlobalSharedClass):
     def __init__(self):
         GlobalSharedClass.__init__(self)
         super().__init__()
 
-        self.detector_2d = Detector2D()
+        self.pipeline = None
         self.previewDetector2d = Detector2D()
-        self.camera = None
-        self.detector_3d = None
+        self.source = None
+        self.worker = None
         self.images = {}
         self.imageB = None
         self.angle = 0
@@ -209,15 +178,22 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         self.detector_2d_config = {}
         self.detectionRound = 0
         self.fillImageList = 0
-        self.imagesPaths = {}
-        self.rawDataFromDetection = {}
+        self.frameIndices = {}
+        self.datums = None
+        self.datumsConfig = None
+        self.samples = GazeSamples()
+        self.provisionalSamples = False
+        self.sessionWriter = None
+        self.sessionPath = None
+        self.gazeCalibration = None
+        self.timestampRate = 1.0
         self.clickedItem = None
         self.image = None
         self.imageFlag = 'Simple'
         self.lastDetectionImage = None
         self.isRunning = False
+        self.timingRefresh = 0
         self.openedWindows = []
-        self.pointsOnDisplay = []
 
         self.__mainWidget = QWidget()
         ui = QFile("ui/main.ui")
@@ -238,12 +214,8 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
             self.config = json.load(json_file)
             json_file.seek(0)
             self.original_config = json.load(json_file)
-            self.detector_2d_config = self.config["detector_2d"].copy()
-            self.detector_2d_config["coarse_detection"] = bool(self.detector_2d_config["coarse_detection"])
-
-            self.detector_3d_config = self.config["detector_3d"].copy()
-            self.detector_3d_config["long_term_mode"] = DetectorMode.blocking if int(self.detector_3d_config["long_term_mode"]) == 0 else DetectorMode.asynchronous
-            self.detector_3d_config["calculate_rms_residual"] = bool(self.detector_3d_config["calculate_rms_residual"])
+            self.detector_2d_config = detector2dConfig(self.config)
+            self.detector_3d_config = detector3dConfig(self.config)
        
         with open('config/default.json') as json_file:
             self.default_config = json.load(json_file)
@@ -400,11 +372,9 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         self.radioButtons.buttonClicked.connect(self.radioClicked)
 
         # Setup scripts
-        self.detector_2d.update_properties(self.detector_2d_config)
         self.previewDetector2d.update_properties(self.detector_2d_config)
-        self.camera = CameraModel(focal_length=self.config['focal_length'], resolution=[640, 480])
-        self.detector_3d = Detector3D(camera=self.camera)
-        self.detector_3d.update_properties(self.detector_3d_config)
+        self.pipeline = DetectionPipeline(self.config, cache=bool(self.config.get("result_cache", 0)),
+                                          tracking=bool(self.config.get("roi_tracking", 0)))
 
         # Title bar design
         self.setupTitleBar(self)
@@ -413,8 +383,8 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         self.__mainWidget.listImages.itemClicked.connect(self.imageClicked)
         self.__mainWidget.startButton.setEnabled(False)
         self.__mainWidget.startButton.clicked.connect(self.startDetection)
-        #self.__mainWidget.calibrate.clicked.connect(self.openCalibrationWindow)
-        #self.__mainWidget.calibrate.setEnabled(False)
+        self.__mainWidget.calibrate.clicked.connect(self.openCalibrationWindow)
+        self.__mainWidget.calibrate.setEnabled(False)
         self.__mainWidget.reanalyze.clicked.connect(self.reanalyze)
         self.__mainWidget.loadImage.clicked.connect(self.loadImage)
         self.__mainWidget.scanpath.clicked.connect(self.showScanpath)
@@ -423,6 +393,22 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         self.__mainWidget.imagePath.setText("Choose image")
         self.__mainWidget.imagePath.setText(self.__mainWidget.imagePath.fontMetrics().elidedText(self.__mainWidget.imagePath.text(), Qt.ElideRight, self.__mainWidget.imagePath.width()))
 
+    def saveCalibration(self, calibration):
+        # kept with the session, through the writer while the detection still writes it
+        self.gazeCalibration = calibration
+        self.calibrateSamples(0)
+        if self.sessionWriter is not None:
+            self.sessionWriter.writeRecord(calibration.toRecord())
+        elif self.sessionPath is not None:
+            appendRecord(self.sessionPath, calibration.toRecord())
+
+    def calibrateSamples(self, start):
+        # calibrated display UV of the samples from start on, evaluated on the fitted model directly
+        if self.gazeCalibration is None or start >= len(self.samples):
+            return
+        uv, _ = self.projectGaze(self.samples.sphere[start:], self.samples.normal[start:])
+        self.samples.gaze[start:] = self.gazeCalibration.apply(uv)
+
     def openCalibrationWindow(self):
         calibrationImage = QFileDialog.getOpenFileName(self, 'Open file', 'c:\\', "Image files (*.jpg *.png *.jpeg)")
         if calibrationImage[0] != "":
@@ -433,14 +419,15 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
     def showHeatmap(self):
         visualizationImage = QFileDialog.getOpenFileName(self, 'Open file', 'c:\\', "Image files (*.jpg *.png *.jpeg)")
         if visualizationImage[0] != "":
-            self.popup = VisualizationWindow(visualizationImage[0], heatmap=True, rawData=self.rawDataFromDetection)
+            self.popup = VisualizationWindow(visualizationImage[0], heatmap=True, rawData=self.samples, calibrated=self.gazeCalibration is not None)
             self.popup.show()
             self.openedWindows.append(self.popup)
 
     def showScanpath(self):
         visualizationImage = QFileDialog.getOpenFileName(self, 'Open file', 'c:\\', "Image files (*.jpg *.png *.jpeg)")
         if visualizationImage[0] != "":
-            self.popup = VisualizationWindow(visualizationImage[0], scanpath=True, rawData=self.rawDataFromDetection)
+            self.popup = VisualizationWindow(visualizationImage[0], scanpath=True, rawData=self.samples, calibrated=self.gazeCalibration is not None,
+                                             minDuration=MIN_FIXATION_DURATION * self.timestampRate)
             self.popup.show()
             self.openedWindows.append(self.popup)
 
@@ -453,9 +440,11 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
 
     def radioClicked(self, button):
         self.imageFlag = button.text().split(" ")[0]
+        if self.isRunning:
+            self.worker.imageFlag = self.imageFlag
         if self.clickedItem:
             self.imageClicked(item=self.clickedItem)
-        elif self.lastDetectionImage:
+        elif self.lastDetectionImage is not None:
             self.__mainWidget.rayRadio.setEnabled(False)
             self.imageClicked(lastImage=self.lastDetectionImage)
 
@@ -563,15 +552,12 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         self.config["detector_3d"]["model_warmup_duration"] = float(self.__mainWidget.modelWarmupDuration.text())
         self.config["detector_3d"]["calculate_rms_residual"] = int(self.__mainWidget.calculateRmsResidual.text() == "True")
       
-        self.detector_2d_config = self.config["detector_2d"].copy()
-        self.detector_2d_config["coarse_detection"] = bool(self.detector_2d_config["coarse_detection"])
-        self.detector_3d_config = self.config["detector_3d"].copy()
-        self.detector_3d_config["long_term_mode"] = DetectorMode.blocking if int(self.detector_3d_config["long_term_mode"]) == 0 else DetectorMode.asynchronous
-        self.detector_3d_config["calculate_rms_residual"] = bool(self.detector_3d_config["calculate_rms_residual"])
+        self.detector_2d_config = detector2dConfig(self.config)
+        self.detector_3d_config = detector3dConfig(self.config)
         self.previewDetector2d = Detector2D(self.detector_2d_config)
         if self.clickedItem:
             self.imageClicked(item=self.clickedItem)
-        elif self.lastDetectionImage:
+        elif self.lastDetectionImage is not None:
             self.imageClicked(lastImage=self.lastDetectionImage)
         self.__mainWidget.saveParameters.setEnabled(True)
 
@@ -679,41 +665,45 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         self.__mainWidget.calculateRmsResidual.setText(str(bool(self.original_config["detector_3d"]['calculate_rms_residual'])))
 
     def resetDetectors(self):
-        self.detector_2d = Detector2D(self.detector_2d_config)
         self.previewDetector2d = Detector2D(self.detector_2d_config)
-        self.camera = CameraModel(focal_length=self.config['focal_length'], resolution=[640, 480])
-        self.detector_3d = Detector3D(camera=self.camera)
-        self.detector_3d.update_properties(self.detector_3d_config)
+        self.pipeline = DetectionPipeline(self.config, cache=bool(self.config.get("result_cache", 0)),
+                                          tracking=bool(self.config.get("roi_tracking", 0)))
 
     def reanalyze(self):
-        self.detector_2d = Detector2D(self.detector_2d_config)
-        self.previewDetector2d = Detector2D(self.detector_2d_config)
-        self.camera = CameraModel(focal_length=self.config['focal_length'], resolution=[640, 480])
-        self.detector_3d = Detector3D(camera=self.camera)
-        self.detector_3d.update_properties(self.detector_3d_config)
+        self.stopDetection()
+        self.resetDetectors()
         self.detectionRound = 0
         self.lastDetectionImage = None
         self.clickedItem = None
-        self.rawDataFromDetection = {}
-        self.pointsOnDisplay = []
+        self.samples = GazeSamples()
+        self.provisionalSamples = False
         self.startDetection()
 
     def loadImage(self):
-        fname = QFileDialog.getOpenFileName(self, 'Open file', 'c:\\', "Image files (*.jpg *.png *.jpeg)")
+        fname = QFileDialog.getOpenFileName(self, 'Open file', 'c:\\', f"Image, video or session files (*.jpg *.png *.jpeg *.avi *.mp4 *.mkv *.mov *{SESSION_EXTENSION})")
+        self.stopDetection()
+        # a saved session brings back its samples and reopens the recording when it is still there
+        session = None
+        if fname[0].endswith(SESSION_EXTENSION):
+            session = loadSession(fname[0])
+            fname = (session.source if session.source and os.path.exists(session.source) else "", fname[1])
         if fname[0] != "":
-            self.imageName = re.search(r'[^/\\&\?]+\.\w+$', fname[0]).group(0)
+            # a session recorded by detect.py can have a whole frame folder as its source
+            isFolder = os.path.isdir(fname[0])
+            self.imageName = os.path.basename(os.path.normpath(fname[0])) if isFolder else re.search(r'[^/\\&\?]+\.\w+$', fname[0]).group(0)
             self.imagePath = fname[0]
-            self.rawDataFromDetection = {}
-            self.pointsOnDisplay = []
+            self.samples = GazeSamples()
+            self.provisionalSamples = False
             self.fillImageList = 0
             self.detectionRound = 0
-            self.imagesPaths = {}
+            self.frameIndices = {}
+            self.datums = None
             self.lastDetectionImage = None
             self.clickedItem = None
             self.resetDetectors()
-            self.folderPath = os.path.dirname(fname[0])
-            file_list = glob.glob(os.path.join(self.folderPath, "*"))
-            self.imageAmount = len(file_list)
+            self.folderPath = fname[0] if isFolder else os.path.dirname(fname[0])
+            self.source = openSource(fname[0], grayscale=True, prefetch=8, cache=bool(self.config.get("frame_cache", 0)))
+            self.imageAmount = len(self.source)
             self.__mainWidget.startButton.setEnabled(True)
             self.__mainWidget.rayRadio.setEnabled(False)
             self.__mainWidget.imageLabel.clear()
@@ -723,103 +713,149 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         else:
             self.imagePath = None
             self.folderPath = None
+            self.source = None
             self.imageAmount = 0
             self.fillImageList = 0
             self.lastDetectionImage = None
             self.clickedItem = None
             self.detectionRound = 0
-            self.imagesPaths = {}
+            self.frameIndices = {}
+            self.datums = None
             self.resetDetectors()
-            self.rawDataFromDetection = {}
-            self.pointsOnDisplay = []
+            self.samples = GazeSamples()
+            self.provisionalSamples = False
             self.__mainWidget.imagePath.setText("Choose image")
             self.__mainWidget.startButton.setEnabled(False)
             self.__mainWidget.rayRadio.setEnabled(False)
             self.__mainWidget.listImages.clear()
             self.__mainWidget.imageLabel.clear()
 
+        self.sessionPath = session.path if session is not None else None
+        self.gazeCalibration = session.calibration if session is not None else None
+        # folder samples are timestamped with frame numbers, videos in seconds
+        self.timestampRate = timestampRate((session.source or "") if session is not None else fname[0])
+        if session is not None:
+            self.samples = session.samples
+            self.calibrateSamples(0)
+            self.__mainWidget.imagePath.setText(os.path.basename(session.path))
+        self.__mainWidget.calibrate.setEnabled(not self.isRunning and len(self.samples) > 0)
+
     def startDetection(self):
+        if self.isRunning:
+            self.worker.requestInterruption()
+            return
+
         if self.imagePath:
             self.clickedItem = None
             self.__mainWidget.rayRadio.setEnabled(False)
-            #self.__mainWidget.calibrate.setEnabled(False)
+            self.__mainWidget.calibrate.setEnabled(False)
             self.isRunning = True
             if self.__mainWidget.rayRadio.isChecked():
                 self.__mainWidget.rawRadio.setChecked(True)
                 self.imageFlag = "Raw"
-            if self.detectionRound == 0:
-                self.renderImage()
-                if self.fillImageList == 0:
-                    self.fillImageList = 1
-                self.detectionRound = 1
-                self.renderImage()
-            else:
-                self.rawDataFromDetection = {}
-                self.pointsOnDisplay = []
-                self.renderImage()
-            #self.__mainWidget.calibrate.setEnabled(True)
-            self.isRunning = False
-
-    def renderImage(self):
-        fileName = self.imageName.split("_")
-        fileNumber = int(fileName[1].split(".")[0])
-        fileFormat = self.imageName.split(".")[-1]
-        for i in range(fileNumber, self.imageAmount):
-            newPath = self.folderPath + "/" + fileName[0] + "_" + str(i) + "." + fileFormat
             if self.fillImageList == 0:
-                listImageName = fileName[0] + "_" + str(i) + "." + fileFormat
-                self.__mainWidget.listImages.addItem(listImageName)
-                self.imagesPaths[listImageName] = newPath
-
-            self.lastDetectionImage = newPath
-            image = cv2.imread(newPath)
-
-            grayscale_array = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-            if self.imageFlag == "2D":
-                result_2d = self.previewDetector2d.detect(grayscale_array, image)
-        
-            elif self.imageFlag == "Simple": 
-                result_2d = self.detector_2d.detect(grayscale_array)  
-                cv2.ellipse(
-                    image,
-                    tuple(int(v) for v in result_2d["ellipse"]["center"]),
-                    tuple(int(v / 2) for v in result_2d["ellipse"]["axes"]),
-                    result_2d["ellipse"]["angle"],
-                    0,
-                    360,
-                    (0, 255, 0), 
-                )
-            else: 
-                result_2d = self.detector_2d.detect(grayscale_array) 
-            result_2d["timestamp"] = i
-            result_3d = self.detector_3d.update_and_detect(result_2d, grayscale_array, apply_refraction_correction=False)
-
-            if self.detectionRound == 1:
-                self.rawDataFromDetection[i] = result_3d
-
-                eyePosWorld = self.transform(np.array(result_3d["sphere"]["center"]), self.cameraPos, self.cameraRotMat)
-                gazeRay = self.normalize(self.rotate(result_3d["circle_3d"]["normal"], self.cameraRotMat))
-
-                intersectionTime = self.intersectPlane(self.displayNormalWorld, self.displayPos, eyePosWorld, gazeRay)
-
-                planeIntersection = np.array([0, 0, 0])
-                if (intersectionTime > 0.0):
-                    planeIntersection = self.getPoint([eyePosWorld, gazeRay], intersectionTime)
-             
-                self.pointsOnDisplay.append(planeIntersection)
-
+                for i in self.source.indices:
+                    listImageName = self.source.name(i)
+                    self.__mainWidget.listImages.addItem(listImageName)
+                    self.frameIndices[listImageName] = i
+                self.fillImageList = 1
+
+            self.samples = GazeSamples()
+            self.provisionalSamples = False
+            self.pipeline.timer.reset()
+            if self.config.get("save_session", 0):
+                self.sessionPath = os.path.join(self.folderPath, self.source.prefix + SESSION_EXTENSION)
+                self.sessionWriter = SessionWriter(self.sessionPath, self.config, self.pipeline, source=os.path.abspath(self.imagePath))
+            self.worker = DetectionWorker(self.pipeline, self.source, self.detectionRound == 0, self.imageFlag, self.reusableDatums())
+            self.worker.frameReady.connect(self.frameDetected)
+            self.worker.resultReady.connect(self.resultDetected)
+            self.worker.progress.connect(self.detectionProgress)
+            self.worker.finished.connect(self.detectionFinished)
+            self.__mainWidget.startButton.setText("Stop Detection")
+            self.worker.start()
+
+    def stopDetection(self):
+        if self.isRunning:
+            self.worker.requestInterruption()
+            self.worker.wait()
+            self.detectionFinished(self.worker)
+
+    def reusableDatums(self):
+        # 2D results of the last run stay valid while the detector_2d config is the same,
+        # its frames were only kept for pupils under the threshold_swirski of that run
+        if self.datums is None:
+            return None
+        detectionKey, threshold_swirski = self.datumsConfig
+        if detectionKey != self.pipeline.detectionKey or self.pipeline.detector_3d_config["threshold_swirski"] > threshold_swirski:
+            return None
+        return self.datums
+
+    def frameDetected(self, i, image):
+        if self.sender() is not self.worker:
+            return
+        self.lastDetectionImage = i
+        with self.worker.pipeline.timer.measure('display'):
             self.displayImage(image)
-            cv2.waitKey(10)
+
+    def resultDetected(self, i, timestamp, result_3d, planeIntersection, provisional):
+        if self.sender() is not self.worker:
+            return
+        # warm-up samples from a partly trained eye model fill the views until the recorded round starts
+        if self.provisionalSamples and not provisional:
+            self.samples.clear()
+        self.provisionalSamples = provisional
+        self.samples.append(i, timestamp, result_3d, planeIntersection)
+        self.calibrateSamples(len(self.samples) - 1)
+        if self.sessionWriter is not None and not provisional:
+            self.sessionWriter.write(self.samples)
+
+    def detectionProgress(self, done, total):
+        if self.sender() is not self.worker:
+            return
+        warmup = "warm-up, provisional samples " if self.provisionalSamples else ""
+        self.setWindowTitle(f'Eye Tracking - {warmup}{done}/{total}')
+        # percentiles over the whole run, refreshed a few times per second
+        if time.monotonic() - self.timingRefresh > 0.25:
+            self.timingRefresh = time.monotonic()
+            self.__mainWidget.timingLabel.setText(self.worker.pipeline.timer.status())
+
+    def detectionFinished(self, worker=None):
+        worker = worker or self.sender()
+        if worker is not self.worker or not self.isRunning:
+            return
+        if worker.cancelled:
+            # the eye model may be only partly warmed up, start over next time
+            self.resetDetectors()
+            self.detectionRound = 0
+        else:
+            self.detectionRound = 1
+            self.datums = worker.datums
+            self.datumsConfig = (worker.pipeline.detectionKey, worker.pipeline.detector_3d_config["threshold_swirski"])
+        if self.sessionWriter is not None:
+            # only a complete run replaces the session saved before
+            if not worker.completed:
+                self.sessionWriter.discard()
+                self.sessionPath = None
+            else:
+                self.sessionWriter.close(self.samples)
+            self.sessionWriter = None
+        if worker.completed and self.config.get("save_timings", 0):
+            worker.pipeline.timer.save(os.path.join(self.folderPath, self.source.prefix + '.timings.json'))
+        self.__mainWidget.calibrate.setEnabled(len(self.samples) > 0)
+        self.isRunning = False
+        self.__mainWidget.timingLabel.setText(worker.pipeline.timer.status())
+        self.setWindowTitle('Eye Tracking')
+        self.__mainWidget.startButton.setText("Start Detection")
+        self.worker = None
 
     def imageClicked(self, item = None, lastImage = None):
         self.clickedItem = item
         if self.clickedItem and not self.isRunning:
             self.__mainWidget.rayRadio.setEnabled(True)
-        path = self.lastDetectionImage if lastImage else self.imagesPaths[item.text()]
-        image = cv2.imread(path)
+        i = self.lastDetectionImage if lastImage is not None else self.frameIndices[item.text()]
+        grayscale_array = self.source.read(i)
+        image = self.colorImage(grayscale_array)
 
-        grayscale_array = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         if self.imageFlag == "2D":
             result_2d = self.previewDetector2d.detect(grayscale_array, image)
         
@@ -837,14 +873,13 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
 
         # TODO: zistiť či nebeži cyklus .. pretože data sa premažu ale v liste obrazky ostanu
         # TODO: nastane index error ked chceli 3D debug
-        elif self.imageFlag == "3D" and self.clickedItem and self.rawDataFromDetection:
-            index = self.__mainWidget.listImages.row(self.clickedItem)
-            data = self.rawDataFromDetection[index]
-            eyePosWorld = self.transform(np.array(data["sphere"]["center"]), self.cameraPos, self.cameraRotMat)
-            gazeRay = self.normalize(self.rotate(data["circle_3d"]["normal"], self.cameraRotMat))
-
-            planeIntersection = self.pointsOnDisplay[index]
-            image = cv2.cvtColor(self.visualizeRaycast(self.pointsOnDisplay, planeIntersection, 
+        elif self.imageFlag == "3D" and self.clickedItem and self.samples.find(i) is not None:
+            row = self.samples.find(i)
+            eyePosWorld = self.transform(self.samples.sphere[row], self.cameraPos, self.cameraRotMat)
+            gazeRay = self.normalize(self.rotate(self.samples.normal[row], self.cameraRotMat))
+
+            planeIntersection = np.nan_to_num(self.samples.display[row])
+            image = cv2.cvtColor(self.visualizeRaycast(self.samples.display, planeIntersection, 
                                                        self.cameraPos, eyePosWorld, self.cameraDirsWorld, gazeRay, 
                                                        screenWidth=self.displaySize[0], screenHeight=self.displaySize[1], 
                                                        rayNumber=0), cv2.COLOR_BGR2RGB) # rayNumber = index + 1
@@ -854,8 +889,14 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
 
         self.displayImage(image)
 
+    def colorImage(self, grayscale_array):
+        # only the 2D debug and ellipse overlays need a color frame to draw on
+        if self.imageFlag == "2D" or self.imageFlag == "Simple":
+            return cv2.cvtColor(grayscale_array, cv2.COLOR_GRAY2BGR)
+        return grayscale_array
+
     def displayImage(self, img):
-        qformat = QImage.Format_Indexed8
+        qformat = QImage.Format_Grayscale8
 
         if len(img.shape) == 3:
             if img.shape[2] == 4:
@@ -960,12 +1001,13 @@ class MainWindow(FramelessMainWindow, GlobalSharedClass):
         return data
 
     def closeEvent(self, event):
+        self.stopDetection()
         for i in self.openedWindows:
             i.close()
         event.accept()
 
 class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
-    def __init__(self, imagePath = None, rawData = None, heatmap = None, scanpath = None):
+    def __init__(self, imagePath = None, rawData = None, heatmap = None, scanpath = None, calibrated = False, minDuration = 0.0):
         GlobalSharedClass.__init__(self)
         super().__init__()
 
@@ -982,7 +1024,8 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
         self.qimg = None
         self.color1 = (0, 0, 0)
         self.color2 = (255, 255, 255) 
-        self.threshold = 1
+        self.threshold = DEFAULT_DISPERSION
+        self.minDuration = minDuration
 
         self.__mainWidget = QWidget()
         ui = QFile("ui/popupWindow.ui")
@@ -1003,15 +1046,32 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
         self.setupTitleBar(self)
 
         self.uv_coords = []	
+        self.uv_times = []
         self.outliers = []
+        self.liveOutliers = []
         self.outliersToDraw = []
+        self.processed = 0
+        self.generation = None
+        self.accumulator = None
+        self.heatmapImage = None
+        self.heatmapKey = None
+        self.baseImage = None
+        self.compositor = None
+        self.outliersLayer = None
+        self.liveRefresh = 250
+        self.tiles = None
+        self.zoom = None
+        self.viewCenter = None
+        self.dragStart = None
         self.dir_vectors = {}
-        self.points_group = {}
+        self.fixationCenters = np.empty((0, 2), int)
+        self.fixationRadii = np.empty(0, int)
+        self.levels = None
         self.repeat = False
         self.thresholdChanged = False
-        self.points_group_keys = []
         self.imagePath = imagePath
         self.rawData = rawData
+        self.calibrated = calibrated
         self.heatmap = heatmap
         self.scanpath = scanpath
         self.__mainWidget.saveImage.clicked.connect(self.saveImage)
@@ -1033,9 +1093,20 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
         if self.rawData:
             self.rawToPoint()
 
+        # very large stimuli are drawn from cached tiles of an image pyramid, only the ones in view
+        if self.heatmap and self.imagePath and isLargeImage(self.imagePath):
+            self.tiles = HeatmapTiles(StimulusPyramid(self.imagePath))
+            self.tiles.setPoints(self.uvToPixels(self.uv_coords, self.tiles.pyramid.width, self.tiles.pyramid.height))
+
         if self.imagePath:
             self.displayImage()
 
+        # a heatmap opened during detection keeps growing, redrawn at most every liveRefresh ms
+        if self.heatmap and self.rawData is not None:
+            self.liveTimer = QTimer(self)
+            self.liveTimer.timeout.connect(self.refreshLive)
+            self.liveTimer.start(self.liveRefresh)
+
     def changeThreshold(self):
         self.displayImage()
 
@@ -1060,31 +1131,132 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
             self.color2 = (b, g, r)
             self.displayImage()
 
+    def closeEvent(self, event):
+        # the background levels are of no use once the window is gone
+        if self.levels is not None:
+            self.levels.stop()
+        event.accept()
+
     def saveImage(self):
         fileName, _ = QFileDialog.getSaveFileName(self, "Save Image", "", "PNG (*.png);;JPEG (*.jpg *.jpeg);;All Files (*)")
         if fileName:
             self.qimg.save(fileName)
 
     def rawToPoint(self):
-        for i in self.rawData:
-            eyePosWorld = self.transform(np.array(self.rawData[i]["sphere"]["center"]), self.cameraPos, self.cameraRotMat)
-            gazeRay = self.normalize(self.rotate(self.rawData[i]["circle_3d"]["normal"], self.cameraRotMat))
-
-            intersectionTime = self.intersectPlane(self.displayNormalWorld, self.displayPos, eyePosWorld, gazeRay)
-
-            if (intersectionTime > 0.0):
-                planeIntersection = self.getPoint([eyePosWorld, gazeRay], intersectionTime)
-                planeIntersection = self.transform(planeIntersection, self.displayPos, self.displayRotMat)
-                result = self.convert_to_uv(planeIntersection, includeOutliers=True)
-                if result[0] > 1 or result[0] < 0 or result[1] > 1 or result[1] < 0:
-                    self.outliers.append(result)
-                else:
-                    self.uv_coords.append(result)
+        self.generation = self.rawData.generation
+        self.uv_coords, self.uv_times, self.outliers = self.projectSamples(0)
+        self.liveOutliers = list(self.outliers)
+        self.processed = len(self.rawData)
+
+    def restartLive(self):
+        # the main window replaced its provisional warm-up samples, everything is projected again
+        self.generation = self.rawData.generation
+        self.processed = 0
+        self.uv_coords, self.uv_times = [], []
+        self.outliers, self.liveOutliers, self.outliersToDraw = [], [], []
+        self.repeat = False
+        self.accumulator = None
+        self.heatmapKey = None
+        if self.tiles is not None:
+            self.tiles.setPoints(np.empty((0, 2), np.int64))
+        if self.levels is not None:
+            self.levels.stop()
+        self.levels = None
+
+    def projectSamples(self, start):
+        # calibrated gaze, corrected by the main window as the samples arrive
+        if self.calibrated:
+            uv = self.rawData.gaze[start:]
+            outliers = ~np.isnan(uv[:, 0]) & ((uv < 0) | (uv > 1)).any(axis=1)
+        else:
+            uv, outliers = self.projectGaze(self.rawData.sphere[start:], self.rawData.normal[start:])
+        onDisplay = ~np.isnan(uv[:, 0]) & ~outliers
+        timestamps = self.rawData.timestamp[start:][onDisplay]
+        return [tuple(point) for point in uv[onDisplay]], list(timestamps), [tuple(point) for point in uv[outliers]]
+
+    def refreshLive(self):
+        if self.rawData.generation != self.generation:
+            self.restartLive()
+        # only the samples added since the last refresh are projected and accumulated
+        if len(self.rawData) == self.processed:
+            return
+        uv_coords, uv_times, outliers = self.projectSamples(self.processed)
+        self.processed = len(self.rawData)
+        self.uv_coords += uv_coords
+        self.uv_times += uv_times
+        if self.accumulator is not None:
+            self.accumulator.add(self.uvToPixels(uv_coords, self.accumulator.width, self.accumulator.height))
+        if self.tiles is not None:
+            self.tiles.addPoints(self.uvToPixels(uv_coords, self.tiles.pyramid.width, self.tiles.pyramid.height))
+        if outliers:
+            # outliersVisualization converts them to pixels in place on its first pass
+            self.liveOutliers += outliers
+            self.outliers = list(self.liveOutliers)
+            self.outliersToDraw = []
+            self.repeat = False
+        self.displayImage()
+
+    def uvToPixels(self, uv_coords, width, height):
+        return (np.array(uv_coords).reshape(-1, 2) * (width, height)).astype(int)
+
+    def fitZoom(self):
+        pyramid = self.tiles.pyramid
+        return min(self.__mainWidget.image.width() / pyramid.width, self.__mainWidget.image.height() / pyramid.height)
+
+    def tiledView(self):
+        # the part of the stimulus in view, from the coarsest pyramid level that still has enough pixels for it
+        pyramid = self.tiles.pyramid
+        if self.zoom is None:
+            self.zoom = self.fitZoom()
+            self.viewCenter = [pyramid.width / 2, pyramid.height / 2]
+
+        viewWidth = min(self.__mainWidget.image.width() / self.zoom, pyramid.width)
+        viewHeight = min(self.__mainWidget.image.height() / self.zoom, pyramid.height)
+        self.viewCenter[0] = min(max(self.viewCenter[0], viewWidth / 2), pyramid.width - viewWidth / 2)
+        self.viewCenter[1] = min(max(self.viewCenter[1], viewHeight / 2), pyramid.height - viewHeight / 2)
+
+        level = min(max(int(np.floor(np.log2(1 / self.zoom))), 0), pyramid.levelCount - 1)
+        levelWidth, levelHeight = pyramid.levelSize(level)
+        x0 = int(self.viewCenter[0] - viewWidth / 2) >> level
+        y0 = int(self.viewCenter[1] - viewHeight / 2) >> level
+        x1 = min(int(np.ceil((self.viewCenter[0] + viewWidth / 2) / 2 ** level)), levelWidth)
+        y1 = min(int(np.ceil((self.viewCenter[1] + viewHeight / 2) / 2 ** level)), levelHeight)
+        region = self.tiles.render(level, x0, y0, x1, y1)
+
+        size = (max(1, round(viewWidth * self.zoom)), max(1, round(viewHeight * self.zoom)))
+        return cv2.resize(region, size, interpolation=cv2.INTER_AREA if region.shape[1] > size[0] else cv2.INTER_LINEAR)
+
+    def wheelEvent(self, event):
+        if self.tiles is None:
+            return super().wheelEvent(event)
+        factor = 1.25 if event.angleDelta().y() > 0 else 1 / 1.25
+        self.zoom = min(max(self.zoom * factor, self.fitZoom()), 4.0)
+        self.displayImage()
+
+    def mousePressEvent(self, event):
+        super().mousePressEvent(event)
+        if self.tiles is not None and event.button() == Qt.LeftButton:
+            self.dragStart = event.position()
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if self.tiles is not None and self.dragStart is not None:
+            position = event.position()
+            self.viewCenter[0] -= (position.x() - self.dragStart.x()) / self.zoom
+            self.viewCenter[1] -= (position.y() - self.dragStart.y()) / self.zoom
+            self.dragStart = position
+            self.displayImage()
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        self.dragStart = None
 
 
     def displayImage(self):
         image = None
-        if self.scanpath and self.rawData:
+        if self.tiles is not None:
+            image = self.tiledView()
+        elif self.scanpath and self.rawData:
             image = self.scanpathVisualization()
             if len(self.outliers):
                 image = self.outliersVisualization(image)
@@ -1095,7 +1267,7 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
                 image = self.outliersVisualization(image)
             self.repeat = True
         else:
-            image = cv2.imread(self.imagePath)
+            image = self.stimulus()
 
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         h, w, c = image.shape
@@ -1107,9 +1279,16 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
             self.__mainWidget.image.setPixmap(QPixmap.fromImage(self.qimg))
             self.__mainWidget.image.setAlignment(Qt.AlignCenter)
 
+    def stimulus(self):
+        # decoded once, every visualization draws over the same image
+        if self.baseImage is None:
+            self.baseImage = cv2.imread(self.imagePath)
+            self.compositor = LayerCompositor(self.baseImage)
+        return self.baseImage
+
     def outliersVisualization(self, image):
         if not self.repeat:
-            img = cv2.imread(self.imagePath)
+            img = self.stimulus()
             self.imageHeight = img.shape[0]
             self.imageWidth = img.shape[1]
             self.paddingMax = min(self.imageHeight, self.imageWidth) // 10
@@ -1128,16 +1307,19 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
 
             self.paddedImage = np.zeros((self.imageHeight + 2 * self.paddingMax,
                                     self.imageWidth + 2 * self.paddingMax, 3), np.uint8)
-        
+            # the outlier dots only change with the outliers, they are kept as their own layer
+            self.outliersLayer = Layer(self.paddedImage, self.drawOutliers)
 
         if len(self.outliersToDraw):
             self.paddedImage[self.paddingMax:self.paddingMax + self.imageHeight,
                             self.paddingMax:self.paddingMax + self.imageWidth] = image
-            
-            for i in range(0, len(self.outliersToDraw)):
-                cv2.circle(self.paddedImage, (self.outliers[i][0] + self.paddingMax, self.outliers[i][1] + self.paddingMax),
-                        5, (0, 0, 255), -1)
-                
+            return self.outliersLayer.blend(self.paddedImage)
+        
+        return image
+
+    def drawOutliers(self, canvas):
+        for x, y in self.outliersToDraw:
+            cv2.circle(canvas, (x + self.paddingMax, y + self.paddingMax), 5, (0, 0, 255), -1)
 
             # x = 1
             # y = 1
@@ -1153,239 +1335,114 @@ class VisualizationWindow(FramelessMainWindow, GlobalSharedClass):
             # for i in range(0, len(points)):
             #     cv2.circle(self.paddedImage, (int(points[i][0] * self.imageWidth + self.paddingMax), int(points[i][1] * self.imageHeight + self.paddingMax)),
             #             10, (0, 255, 0), -1)
-
-            return self.paddedImage
-        
-        return image
             
 
     def scanpathVisualization(self):
+        image = self.stimulus()
         if not len(self.uv_coords):
-            return cv2.imread(self.imagePath)
+            return image
 
-        image = cv2.imread(self.imagePath)
         image_width = image.shape[1]
         image_height = image.shape[0]
         circle_radius = min(image_width, image_height) // 100
 
-        overlay_circles = image.copy()
-        overlay_lines = image.copy()
         alpha_circles = 0.6
-        outline_width = 3
         alpha_lines = 0.2
-        TEXT_FACE = cv2.FONT_HERSHEY_SIMPLEX
-        TEXT_SCALE = 0.8
-        TEXT_THICKNESS = 2
-        TEXT_COLOR = (0, 0, 0)
+        points = self.uvToPixels(self.uv_coords, image_width, image_height)
 
-        colors = {}
-        order = 0
-    
-        if not self.repeat:
-            for i in range(0, len(self.uv_coords)):
-                self.uv_coords[i] = self.convert_uv_to_px(self.uv_coords[i], image_width, image_height)
+        # I-DT fixations of at least minDuration over the sample timestamps (the threshold is their dispersion in pixels).
+        # The shown threshold is computed first, the others in the background so a new threshold only picks its level
+        if self.levels is None:
+            self.levels = DispersionLevels(self.uv_times, points, self.minDuration)
+            self.levels.fixations(self.threshold)
+            thresholds = sorted(range(MAX_DISPERSION + 1), key=lambda threshold: abs(threshold - self.threshold))
+            Thread(target=self.levels.precompute, args=(thresholds,), daemon=True).start()
 
         if not self.thresholdChanged:
             self.thresholdChanged = True
-            self.points_group = {}
-            main_point = None
-
-            for i in range(0, len(self.uv_coords)):
-                if not main_point:
-                    main_point = (self.uv_coords[i][0], self.uv_coords[i][1])
-
-                if abs(self.uv_coords[i][0] - main_point[0]) <= self.threshold and abs(self.uv_coords[i][1] - main_point[1]) <= self.threshold:
-                    if not self.points_group.get(order):
-                        self.points_group[order] = {'points': [self.uv_coords[i]], 'middle': {'x': 0, 'y': 0}, 'diameter': 0, 'index': order + 1}
-                    else:
-                        self.points_group[order]['points'].append(self.uv_coords[i])
-                
-                else:
-                    order += 1
-                    main_point = (self.uv_coords[i][0], self.uv_coords[i][1])
-                    self.points_group[order] = {'points': [self.uv_coords[i]], 'middle': {'x': 0, 'y': 0}, 'diameter': 0, 'index': order + 1}
-
-            # self.points_group = dict(sorted(self.points_group.items(), key=lambda item: len(item[1]['points']), reverse=False))
-            self.points_group_keys = list(self.points_group)    
-
-            for key in self.points_group:
-                points = self.points_group[key]['points']
-                x = 0
-                y = 0
-
-                for point in points:
-                    x += point[0]
-                    y += point[1]
-
-                x = int(x / len(points))
-                y = int(y / len(points))
-                self.points_group[key]['middle']['x'] = x
-                self.points_group[key]['middle']['y'] = y            
-
-            different_lengths = {}
-            for key in self.points_group:
-                if not different_lengths.get(len(self.points_group[key]['points'])):
-                    different_lengths[len(self.points_group[key]['points'])] = [key]
-                else:
-                    different_lengths[len(self.points_group[key]['points'])].append(key)
+            fixations = self.levels.fixations(self.threshold)
+            self.setWindowTitle(f'Scanpath - {len(fixations)} fixations within {self.threshold} px')
+            self.fixationCenters = np.column_stack((fixations.x, fixations.y)).astype(int)
 
-            # base pixel for diameter ---- diameter = 20
-            # normalize between new_min and new_max ---- normalized_value = ((original_value - min_value) / (max_value - min_value)) * (new_max - new_min) + new_min
+            # circles from 1x to 4x circle_radius by fixation duration
             new_min = 1
             new_max = 4
-            # normalize between 1 and 2 ---- normalized_value = (value - min_length) / (max_length - min_length) + 1
-
-            if len(different_lengths) > 1:
-                max_length = max(different_lengths)
-                min_length = min(different_lengths)
-                for value in different_lengths:
-                    normalized_value = ((value - min_length) / (max_length - min_length)) * (new_max - new_min) + new_min
-                    for key in different_lengths[value]:
-                        self.points_group[key]['diameter'] = int(circle_radius * normalized_value)
-            else:
-                for key in different_lengths:
-                    for value in different_lengths[key]:
-                        self.points_group[value]['diameter'] = circle_radius
-
-        if len(self.points_group) > 1:
-            t = 0
-            for key in self.points_group:
-                r = min(255, max(0, int(self.lerp(self.color1[0], self.color2[0], t))))
-                g = min(255, max(0, int(self.lerp(self.color1[1], self.color2[1], t))))
-                b = min(255, max(0, int(self.lerp(self.color1[2], self.color2[2], t))))
-                colors[key] = (r, g, b)
-                t += 1 / (len(self.points_group) - 1)
-        else:
-            colors[0] = (self.color1[0], self.color1[1], self.color1[2])
-
-        for key in range(0, len(self.points_group)):
-            x1 = self.points_group[self.points_group_keys[key]]['middle']['x']
-            y1 = self.points_group[self.points_group_keys[key]]['middle']['y']
-            radius1 = self.points_group[self.points_group_keys[key]]['diameter']
-            if key < len(self.points_group) - 1:
-                x2 = self.points_group[self.points_group_keys[key + 1]]['middle']['x']
-                y2 = self.points_group[self.points_group_keys[key + 1]]['middle']['y']
-                radius2 = self.points_group[self.points_group_keys[key + 1]]['diameter']
-
-                distance = sqrt((x2 - x1)**2 + (y2 - y1)**2)
-
-                if distance >= (radius1 + radius2):   
-                    angle = atan2(y2 - y1, x2 - x1)
-                    point1_x = x1 + (radius1 + outline_width // 2) * cos(angle)
-                    point1_y = y1 + (radius1 + outline_width // 2) * sin(angle)
-                    point2_x = x2 - (radius2 + outline_width // 2) * cos(angle)
-                    point2_y = y2 - (radius2 + outline_width // 2) * sin(angle)
-                    cv2.line(overlay_lines, (int(point1_x), int(point1_y)), (int(point2_x), int(point2_y)), colors[list(self.points_group)[key]], 4)
-            
-            text_size, _ = cv2.getTextSize(str(self.points_group[self.points_group_keys[key]]['index']), TEXT_FACE, TEXT_SCALE, TEXT_THICKNESS)
-            text_origin = (int(x1 - text_size[0] / 2), int(y1 + text_size[1] / 2))
-            
-            #cv2.circle(overlay_circles, (x1, y1), radius1, colors[points_group_keys[key]], -1)
-            cv2.circle(overlay_circles, (x1, y1), radius1, colors[self.points_group_keys[key]], outline_width)
-            #cv2.putText(overlay_circles, str(points_group[points_group_keys[key]]['index']), text_origin, TEXT_FACE, TEXT_SCALE, TEXT_COLOR, TEXT_THICKNESS, cv2.LINE_AA)
-
-
-        result = cv2.addWeighted(overlay_circles, alpha_circles, image, 1 - alpha_circles, 0)
-        result = cv2.addWeighted(overlay_lines, alpha_lines, result, 1 - alpha_lines, 0)
-        return result
+            self.fixationRadii = np.full(len(fixations), circle_radius)
+            if len(fixations) and np.ptp(fixations.duration) > 0:
+                normalized = (fixations.duration - fixations.duration.min()) / np.ptp(fixations.duration) * (new_max - new_min) + new_min
+                self.fixationRadii = (circle_radius * normalized).astype(int)
+
+        # only the layers whose threshold or colors changed are drawn again
+        key = (self.generation, len(self.uv_coords), self.threshold, self.color1, self.color2)
+        self.compositor.setLayer('circles', key, self.drawCircles, alpha_circles)
+        self.compositor.setLayer('lines', key, self.drawLines, alpha_lines)
+        return self.compositor.compose(['circles', 'lines'])
+
+    def colorBands(self):
+        # fixation colors along the gradient from color1 to color2, fixations of one color are drawn in one call
+        count = len(self.fixationCenters)
+        t = np.linspace(0, 1, count)[:, None] if count > 1 else np.zeros((count, 1))
+        ramp = np.clip(self.lerp(np.array(self.color1), np.array(self.color2), t).astype(int), 0, 255)
+        bands, band = np.unique(ramp, axis=0, return_inverse=True)
+        band = band.reshape(-1)
+        return bands.tolist(), band
+
+    def drawCircles(self, canvas):
+        outline_width = 3
+        if not len(self.fixationCenters):
+            return
+        colors, band = self.colorBands()
+        # outline polygons the way cv2.circle approximates them, one per radius moved to every center
+        order = np.lexsort((band, self.fixationRadii))
+        groups = np.flatnonzero(np.diff(self.fixationRadii[order]) | np.diff(band[order])) + 1
+        for group in np.split(order, groups):
+            radius = int(self.fixationRadii[group[0]])
+            delta = 90 if radius < 3 else 30 if radius < 10 else 18 if radius < 15 else 5
+            outline = cv2.ellipse2Poly((0, 0), (radius, radius), 0, 0, 360, delta)
+            cv2.polylines(canvas, (self.fixationCenters[group][:, None] + outline).astype(np.int32), True,
+                          colors[band[group[0]]], outline_width)
+
+    def drawLines(self, canvas):
+        outline_width = 3
+        if len(self.fixationCenters) < 2:
+            return
+        colors, band = self.colorBands()
+        # segments between neighbouring circles that do not overlap, ending at their outlines
+        start, end = self.fixationCenters[:-1], self.fixationCenters[1:]
+        startRadius, endRadius = self.fixationRadii[:-1], self.fixationRadii[1:]
+        offset = end - start
+        distance = np.hypot(offset[:, 0], offset[:, 1])
+        separate = distance >= startRadius + endRadius
+        direction = offset[separate] / np.maximum(distance[separate], 1e-12)[:, None]
+        segments = np.stack((start[separate] + (startRadius[separate] + outline_width // 2)[:, None] * direction,
+                             end[separate] - (endRadius[separate] + outline_width // 2)[:, None] * direction), axis=1)
+        segments = np.trunc(segments).astype(np.int32)
+        segmentBand = band[:-1][separate]
+        for color in np.unique(segmentBand):
+            cv2.polylines(canvas, segments[segmentBand == color], False, colors[color], 4)
 
     
     def heatmapVisualization(self):
-        if not len(self.uv_coords):
-            return cv2.imread(self.imagePath)
-
-        img = cv2.imread(self.imagePath)
-
-        dpi = 100.0
-        alpha = 0.5
-        ngaussian = 200
-        sd = 8
-        width = img.shape[1]
-        height = img.shape[0]
-        
-        for i in range(0, len(self.uv_coords)):
-            self.uv_coords[i] = self.convert_uv_to_px(self.uv_coords[i], width, height)
-
-        figsize = (width / dpi, height / dpi)
-        fig = pyplot.figure(figsize=figsize, dpi=dpi, frameon=False)
-
-        ax = pyplot.Axes(fig, [0, 0, 1, 1])
-        ax.set_axis_off()
-        fig.add_axes(ax)
-        ax.axis([0, width, 0, height])
-        ax.imshow(img)
-
-        # HEATMAP
-        # Gaussian
-        gwh = ngaussian
-        gsdwh = sd
-        
-        xo = gwh / 2
-        yo = gwh / 2
-
-        gaus = np.zeros([gwh, gwh], dtype=float)
-
-        for i in range(gwh):
-            for j in range(gwh):
-                gaus[j, i] = np.exp(
-                    -1.0 * (((float(i) - xo) ** 2 / (2 * gsdwh * gsdwh)) + ((float(j) - yo) ** 2 / (2 * gsdwh * gsdwh))))
-
-        # matrix of zeroes
-        strt = gwh // 2
-        heatmapsize = height + 2 * strt, width + 2 * strt
-        heatmap = np.zeros(heatmapsize, dtype=float)
-        # create heatmap
-        for i in range(0, len(self.uv_coords)):
-            # get x and y coordinates
-            x = strt + self.uv_coords[i][0] - int(gwh / 2)
-            y = strt + self.uv_coords[i][1] - int(gwh / 2)
-            # correct Gaussian size if either coordinate falls outside of
-            # display boundaries
-            if (not 0 < x < width) or (not 0 < y < height):
-                hadj = [0, gwh];
-                vadj = [0, gwh]
-                if 0 > x:
-                    hadj[0] = abs(x)
-                    x = 0
-                elif width < x:
-                    hadj[1] = gwh - int(x - width)
-                if 0 > y:
-                    vadj[0] = abs(y)
-                    y = 0
-                elif height < y:
-                    vadj[1] = gwh - int(y - height)
-                # add adjusted Gaussian to the current heatmap
-                try:
-                    heatmap[y:y + vadj[1], x:x + hadj[1]] += gaus[vadj[0]:vadj[1], hadj[0]:hadj[1]] * self.uv_coords[i][2]
-                except:
-                    # fixation was probably outside of display
-                    pass
-            else:
-                # add Gaussian to the current heatmap
-                heatmap[y:y + gwh, x:x + gwh] += gaus
-        # resize heatmap
-        heatmap = heatmap[strt:height + strt, strt:width + strt]
-        # remove zeros
-        lowbound = np.mean(heatmap[heatmap > 0])
-        heatmap[heatmap < lowbound] = np.NaN
-        # draw heatmap on top of image
-        ax.imshow(heatmap, cmap='jet', alpha=alpha)
-
-        # FINISH PLOT
-        # invert the y axis, as (0,0) is top left on a display
-        ax.invert_yaxis()
-        fig.canvas.draw()
-        data = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-        data = data.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-        pyplot.close(fig)
-        return data
+        img = self.stimulus()
+        if self.accumulator is None:
+            self.accumulator = HeatmapAccumulator(img.shape[1], img.shape[0], ngaussian=200, sd=8)
+            self.accumulator.add(self.uvToPixels(self.uv_coords, img.shape[1], img.shape[0]))
+
+        if not self.accumulator.count:
+            return img
+        # blended again only when samples were added
+        if self.heatmapKey != self.accumulator.count:
+            self.heatmapImage = overlayHeatmap(img, self.accumulator.heatmap(), alpha=0.5)
+            self.heatmapKey = self.accumulator.count
+        return self.heatmapImage
     
 class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
     def __init__(self, mainApp, imagePath):
         GlobalSharedClass.__init__(self)
         super().__init__()
 
-        self.rawData = mainApp.rawDataFromDetection
+        self.mainApp = mainApp
+        self.rawData = mainApp.samples
         self.image = cv2.imread(imagePath)
         self.imageCopy = None
         self.qimg = None
@@ -1403,21 +1460,23 @@ class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
         self.circleRadius = 10
         self.repeat = False
         self.uv_coords = []
-        self.dir_vectors = {}
+        self.pixelTree = None
         self.pointsInRadius = []
         self.mappedPoints = {}
         self.mappedPointsToDraw = []
+        # frames already picked, for the current point and for the saved ones
+        self.framesInRadius = set()
+        self.mappedFrames = set()
+        # where each calibration point was clicked, the UV its samples should map to
+        self.targets = {}
+        self.rawUV = np.empty((0, 2))
+        self.calibrationModel = mainApp.config.get("calibration_model", "affine")
         self.calPointIndex = 1
         self.orderText = {1: "st", 2: "nd", 3: "rd", 4: "th", 5: "th"}
         self.circleCenter = None
         self.circleActive = False
 
         self.loader = QUiLoader()
-        self.planeNormal = np.array([0, 1, 0])
-        self.planeCenter = np.array([0, -500, 0])
-        self.planeRot = np.array([0, 0, 180])
-        self.cameraPos = np.array([0, -50, 0])
-        self.cameraRot = np.array([90, 0, 0])
 
         self.__mainWidget = QWidget()
         ui = QFile("ui/calibrationPopupWindow.ui")
@@ -1460,8 +1519,11 @@ class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
         
         if self.calPointIndex < 6:
             self.mappedPoints[self.calPointIndex] = self.pointsInRadius
+            self.targets[self.calPointIndex] = (self.circleCenter[0] / self.image.shape[1], self.circleCenter[1] / self.image.shape[0])
             self.mappedPointsToDraw = [*self.mappedPointsToDraw, *self.pointsInRadius]
+            self.mappedFrames |= self.framesInRadius
             self.pointsInRadius = []
+            self.framesInRadius = set()
             self.circleActive = False
             self.image = self.imageCopy.copy()
             self.displayImage(self.image)
@@ -1473,12 +1535,19 @@ class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
             self.calibrate()
 
     def calibrate(self):
-        for i in self.mappedPoints:
-            print("Point: ", i)
-            for j in self.mappedPoints[i]:
-                print(self.rawData[j[1]])
+        # exact UV of the picked samples, not their pixels
+        points = [self.rawUV[self.rawData.rows([j[1] for j in self.mappedPoints[i]])] for i in self.mappedPoints]
+        targets = [self.targets[i] for i in self.mappedPoints]
+        try:
+            calibration = fitCalibration(points, targets, self.calibrationModel)
+        except ValueError as e:
+            self.__mainWidget.label.setText(str(e))
+            return
 
-            print("\n\n")
+        self.mainApp.saveCalibration(calibration)
+        size = (self.image.shape[1], self.image.shape[0])
+        error = np.hypot(*np.concatenate([(calibration.apply(p) - t) * size for p, t in zip(points, targets)]).T).mean()
+        self.__mainWidget.label.setText(f'{calibration.model.capitalize()} calibration, mean error {error:.1f} px')
 
     def setRadius(self):
         if self.__mainWidget.radiusInput.text() != '':
@@ -1501,25 +1570,12 @@ class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
             self.drawPoints()
 
     def rawToPoint(self):
-        for i in self.rawData:
-            self.dir_vectors[i] = {"sphere": np.array(self.transfer_vector(self.rawData[i]["sphere"]["center"], 
-                                                                           self.cameraPos, self.cameraRot)),
-                                   "circle_3d": np.array(self.transfer_vector(self.rawData[i]["circle_3d"]["center"],
-                                                                              self.cameraPos, self.cameraRot))}
-
-        for i in self.dir_vectors:
-            rayOrigin = self.dir_vectors[i]["sphere"]
-            rayDirection = self.normalize(np.array(self.dir_vectors[i]["circle_3d"]) - self.dir_vectors[i]["sphere"])
-            intersectionTime = self.intersectPlane(self.planeNormal, self.planeCenter, rayOrigin, rayDirection)
-            
-            if (intersectionTime > 0.0):
-                planeIntersection = self.getPoint([rayOrigin, rayDirection], intersectionTime)
-                # TODO: world to display local transformation
-                planeIntersection = self.transfer_vector(planeIntersection, self.planeCenter, self.planeRot)
-                #planeIntersection[0] = -planeIntersection[0] # otočena obrazovka
-                result = self.convert_to_uv(planeIntersection)
-                if result:
-                    self.uv_coords.append((result, i))
+        # the same uncalibrated display UV the visualizations project, so the fitted correction applies to it
+        keys = self.rawData.frame
+        uv, outliers = self.projectGaze(self.rawData.sphere, self.rawData.normal)
+        self.rawUV = uv
+        onDisplay = ~np.isnan(uv[:, 0]) & ~outliers
+        self.uv_coords = [(tuple(uv[row]), int(keys[row])) for row in np.flatnonzero(onDisplay)]
 
     def renderImage(self):
         for i in range(0, len(self.uv_coords)):
@@ -1528,6 +1584,9 @@ class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
         for i in self.uv_coords:
             cv2.circle(self.image, i[0], 1, (0, 0, 0), -1)
 
+        # sample pixels indexed once, a click only visits the samples near it
+        self.pixelTree = cKDTree(np.array([i[0] for i in self.uv_coords]).reshape(-1, 2))
+
         self.displayImage(self.image)
 
     def drawCircle(self):
@@ -1586,18 +1645,19 @@ class CalibrationWindow(FramelessMainWindow, GlobalSharedClass):
             if y > 35 + self.imageY and y < 35 + self.imageY + self.imageHeight and x >= 0 + self.imageX and x <= self.imageX + self.imageWidth:
                 x = (x - self.imageX) / self.scaleX
                 y = (y - self.imageY - 35) / self.scaleY
-                for i in self.uv_coords:
-                    if self.distance(i[0], (x, y)) <= self.radius:
-                        if self.button == 'left' and not self.circleActive:
-                            if not True in map(lambda x: x[1] == i[1], self.pointsInRadius) \
-                                and not True in map(lambda x: x[1] == i[1], self.mappedPointsToDraw):
-                                self.pointsInRadius.append(i)               
+                if self.button == 'left' and not self.circleActive:
+                    for row in self.pixelTree.query_ball_point((x, y), self.radius, return_sorted=True):
+                        i = self.uv_coords[row]
+                        if i[1] not in self.framesInRadius and i[1] not in self.mappedFrames:
+                            self.pointsInRadius.append(i)
+                            self.framesInRadius.add(i[1])
 
                 if self.button == 'left' and not self.circleActive:
                     self.circleCenter = (int(x), int(y))
                 elif self.button == 'right' and self.circleActive:
                     self.circleCenter = "reset"
                     self.pointsInRadius = []
+                    self.framesInRadius = set()
 
                 if len(self.pointsInRadius) > 0:
                     self.__mainWidget.save.setEnabled(True)
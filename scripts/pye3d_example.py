@@ -22,15 +22,22 @@ detector_3d_original = Detector3D(camera=camera, long_term_mode=DetectorMode.blo
 
 rep = 0
 data = {}
+frames = []
 
 def loop():
-    for i in range(121):
-        image = cv2.imread(f"dataset/synthetizedImages_no_glint_denoised/example_{i}.png")
-        # read video frame as numpy array
-        grayscale_array = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        # run 2D detector on video frame
-        result_2d = detector_2d.detect(grayscale_array)
-        result_2d["timestamp"] = i
+    if not frames:
+        for i in range(121):
+            image = cv2.imread(f"dataset/synthetizedImages_no_glint_denoised/example_{i}.png")
+            # read video frame as numpy array
+            grayscale_array = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            # run 2D detector on video frame
+            result_2d = detector_2d.detect(grayscale_array)
+            result_2d["timestamp"] = i
+            frames.append((image, grayscale_array, result_2d))
+
+    # second loop reuses the 2D results of the first one
+    for i, (image, grayscale_array, result_2d) in enumerate(frames):
+        image = image.copy()
         # pass 2D detection result to 3D detector
         result_3d_original = detector_3d_original.update_and_detect(result_2d, grayscale_array, apply_refraction_correction=False)
 
@@ -0,0 +1,23 @@
+import pytest
+
+from tracking.frames import PrefetchSource
+
+
+class FailingStream():
+    randomAccess = False
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        yield 0, 0, None
+        raise ValueError("corrupt frame")
+
+
+def test_prefetch_stream_raises_decoder_error():
+    # a decoder error must not end the run as if the stream was read to the end
+    frames = []
+    with pytest.raises(ValueError, match="corrupt frame"):
+        for frame in PrefetchSource(FailingStream()):
+            frames.append(frame)
+    assert frames == [(0, 0, None)]
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+
+from tracking.layers import LayerCompositor
+
+
+def drawCircles(canvas):
+    for center, radius in (((60, 50), 20), ((90, 60), 25), ((150, 110), 8)):
+        cv2.circle(canvas, center, radius, (40, 200, 90), 3)
+
+
+def drawLines(canvas):
+    cv2.line(canvas, (60, 50), (150, 110), (250, 30, 10), 4)
+    cv2.line(canvas, (10, 140), (190, 5), (0, 0, 255), 4)
+
+
+def test_compositor_matches_full_frame_blends():
+    # the scanpath before the compositor: circles then lines, each blended over the whole frame
+    image = np.random.default_rng(0).integers(0, 256, (160, 200, 3), dtype=np.uint8)
+    circles, lines = image.copy(), image.copy()
+    drawCircles(circles)
+    drawLines(lines)
+    expected = cv2.addWeighted(circles, 0.6, image, 0.4, 0)
+    expected = cv2.addWeighted(lines, 0.2, expected, 0.8, 0)
+
+    compositor = LayerCompositor(image)
+    compositor.setLayer('circles', 0, drawCircles, 0.6)
+    compositor.setLayer('lines', 0, drawLines, 0.2)
+    assert np.array_equal(compositor.compose(['circles', 'lines']), expected)
@@ -0,0 +1,16 @@
+import os
+
+import detect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_tracked_workers_match_single_process(tmp_path):
+    # tracking chunks do not depend on which worker gets them, any worker count gives the same samples
+    outputs = []
+    for workers in (1, 3):
+        outputPath = tmp_path / f"j{workers}"
+        assert detect.main([os.path.join(ROOT, 'dataset', 'latest'), '--track', '-j', str(workers),
+                            '-c', os.path.join(ROOT, 'config', 'config.json'), '-o', str(outputPath)]) == 0
+        outputs.append((outputPath / 'latest.csv').read_bytes())
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,70 @@
+import numpy as np
+
+# distinct calibration points each model needs
+CALIBRATION_MODELS = {"affine": 3, "homography": 4}
+
+
+def designMatrix(points, model):
+    return np.column_stack((points, np.ones(len(points))))
+
+
+def normalization(points):
+    # moves the points to mean 0 and mean distance sqrt(2), keeps the homography fit well conditioned
+    center = points.mean(axis=0)
+    scale = np.sqrt(2) / max(np.hypot(*(points - center).T).mean(), 1e-12)
+    return np.array([[scale, 0, -scale * center[0]], [0, scale, -scale * center[1]], [0, 0, 1]])
+
+
+class Calibration():
+    # Correction of display UV gaze, the result of fitCalibration. Maps (N,2) UV in one pass
+    def __init__(self, model, coefficients, error=None):
+        self.model = model
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.error = error
+
+    def apply(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.model == "homography":
+            mapped = np.column_stack((points, np.ones(len(points)))) @ self.coefficients.T
+            return mapped[:, :2] / mapped[:, 2:]
+        return designMatrix(points, self.model) @ self.coefficients
+
+    def toRecord(self):
+        return {"type": "calibration", "model": self.model, "coefficients": self.coefficients.tolist(), "error": self.error}
+
+    @staticmethod
+    def fromRecord(record):
+        return Calibration(record["model"], record["coefficients"], record.get("error"))
+
+
+def fitCalibration(points, targets, model="affine"):
+    # points: one (Ni,2) array of measured UV per calibration point, targets: (K,2) UV the points should map to.
+    # Every calibration point weighs the same however many samples it has
+    if model not in CALIBRATION_MODELS:
+        raise ValueError(f"Unknown calibration model '{model}'")
+    points = [np.asarray(p, dtype=float).reshape(-1, 2) for p in points]
+    used = [i for i in range(len(points)) if len(points[i])]
+    if len(used) < CALIBRATION_MODELS[model]:
+        raise ValueError(f"A {model} calibration needs at least {CALIBRATION_MODELS[model]} points with samples")
+
+    measured = np.concatenate([points[i] for i in used])
+    expected = np.repeat(np.asarray(targets, dtype=float).reshape(-1, 2)[used], [len(points[i]) for i in used], axis=0)
+    weights = np.repeat([1 / np.sqrt(len(points[i])) for i in used], [len(points[i]) for i in used])[:, None]
+
+    if model == "homography":
+        # direct linear transform on normalized points, the null vector of the stacked constraints
+        source, target = normalization(measured), normalization(expected)
+        x, y = (measured @ source[:2, :2].T + source[:2, 2]).T
+        u, v = (expected @ target[:2, :2].T + target[:2, 2]).T
+        zeros, ones = np.zeros(len(x)), np.ones(len(x))
+        constraints = np.vstack((np.column_stack((x, y, ones, zeros, zeros, zeros, -u * x, -u * y, -u)) * weights,
+                                 np.column_stack((zeros, zeros, zeros, x, y, ones, -v * x, -v * y, -v)) * weights))
+        homography = np.linalg.inv(target) @ np.linalg.svd(constraints, full_matrices=False)[2][-1].reshape(3, 3) @ source
+        calibration = Calibration(model, homography / homography[2, 2])
+    else:
+        # both UV components solved together
+        coefficients = np.linalg.lstsq(designMatrix(measured, model) * weights, expected * weights, rcond=None)[0]
+        calibration = Calibration(model, coefficients)
+
+    calibration.error = float(np.hypot(*(calibration.apply(measured) - expected).T).mean())
+    return calibration
@@ -0,0 +1,21 @@
+import json
+
+from pye3d.detector_3d import DetectorMode
+
+
+def loadConfig(path='config/config.json'):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def detector2dConfig(config):
+    detector_2d_config = config["detector_2d"].copy()
+    detector_2d_config["coarse_detection"] = bool(detector_2d_config["coarse_detection"])
+    return detector_2d_config
+
+
+def detector3dConfig(config):
+    detector_3d_config = config["detector_3d"].copy()
+    detector_3d_config["long_term_mode"] = DetectorMode.blocking if int(detector_3d_config["long_term_mode"]) == 0 else DetectorMode.asynchronous
+    detector_3d_config["calculate_rms_residual"] = bool(detector_3d_config["calculate_rms_residual"])
+    return detector_3d_config
@@ -0,0 +1,168 @@
+import numpy as np
+
+# shortest fixation the scanpath shows, in seconds
+MIN_FIXATION_DURATION = 0.1
+# dispersion threshold (x range + y range of a fixation) the scanpath opens with and its largest value, in pixels.
+# 50 px is about 1 degree of visual angle on a desktop display
+DEFAULT_DISPERSION = 50
+MAX_DISPERSION = 500
+
+
+class Fixations():
+    # Fixations as arrays, first and last are the indices of their first and last sample
+    def __init__(self, timestamps, points, first, last):
+        self.first = first
+        self.last = last
+        self.start = timestamps[first]
+        self.end = timestamps[last]
+        self.duration = self.end - self.start
+        self.count = last - first + 1
+        # centroids from a cumulative sum, one subtraction per fixation
+        sums = np.vstack((np.zeros((1, 2)), np.cumsum(points, axis=0)))
+        centroids = (sums[last + 1] - sums[first]) / self.count[:, None]
+        self.x = centroids[:, 0]
+        self.y = centroids[:, 1]
+
+    def __len__(self):
+        return len(self.first)
+
+
+def samples(timestamps, points):
+    timestamps = np.asarray(timestamps, dtype=float).reshape(-1)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    return timestamps, points
+
+
+def ivt(timestamps, points, velocityThreshold, minDuration=0.0):
+    # I-VT: runs of samples moving slower than velocityThreshold (point units per timestamp unit)
+    timestamps, points = samples(timestamps, points)
+    if not len(timestamps):
+        return Fixations(timestamps, points, np.empty(0, int), np.empty(0, int))
+
+    interval = np.maximum(np.diff(timestamps), np.finfo(float).eps)
+    velocity = np.hypot(*np.diff(points, axis=0).T) / interval
+    # the first sample moves like the second one
+    velocity = np.concatenate((velocity[:1], velocity)) if len(velocity) else np.zeros(1)
+    slow = np.concatenate(([False], velocity < velocityThreshold, [False]))
+    edges = np.diff(slow.astype(np.int8))
+    first = np.flatnonzero(edges == 1)
+    last = np.flatnonzero(edges == -1) - 1
+
+    keep = timestamps[last] - timestamps[first] >= minDuration
+    return Fixations(timestamps, points, first[keep], last[keep])
+
+
+def windowDispersion(points, first, last):
+    # (max x - min x) + (max y - min y) of every window first..last, from a sparse table of
+    # power of two window extremes that only goes up to the longest window
+    length = last - first + 1
+    levels = np.floor(np.log2(length)).astype(int)
+    dispersion = np.zeros(len(first))
+    low = high = points
+    for level in range(levels.max() + 1 if len(levels) else 0):
+        if level:
+            step = 1 << (level - 1)
+            low = np.minimum(low[:-step], low[step:])
+            high = np.maximum(high[:-step], high[step:])
+        rows = np.flatnonzero(levels == level)
+        if len(rows):
+            tail = last[rows] - (1 << level) + 1
+            windowLow = np.minimum(low[first[rows]], low[tail])
+            windowHigh = np.maximum(high[first[rows]], high[tail])
+            dispersion[rows] = (windowHigh - windowLow).sum(axis=1)
+    return dispersion
+
+
+def idt(timestamps, points, dispersionThreshold, minDuration=0.0):
+    # I-DT: a window covering minDuration starts a fixation when its dispersion stays within
+    # dispersionThreshold, and grows until the next sample would break it
+    return DispersionLevels(timestamps, points, minDuration).fixations(dispersionThreshold)
+
+
+def spread(low, high, level, first, last):
+    # dispersion of the windows first..last from the 2^level extremes, for lengths from 2^level to 2^(level + 1)
+    tail = last - (1 << level) + 1
+    return (np.maximum(high[first], high[tail]) - np.minimum(low[first], low[tail])).sum(axis=1)
+
+
+def growWindows(points, starts, dispersionThreshold):
+    # last sample every window from starts can grow to within the threshold, all windows at once: they double
+    # in length until they break, then a binary search between the two lengths finds the end
+    count = len(points)
+    last = np.full(len(starts), count - 1)
+    rows = np.arange(len(starts))
+    low = high = points
+    level = 0
+    while len(rows):
+        first = starts[rows]
+        end = np.minimum(first + (2 << level) - 1, count - 1)
+        broken = spread(low, high, level, first, end) > dispersionThreshold
+
+        # length 2^level fits, length up to end does not
+        fits, breaks = first[broken] + (1 << level) - 1, end[broken]
+        while np.any(breaks - fits > 1):
+            middle = (fits + breaks) // 2
+            within = spread(low, high, level, first[broken], middle) <= dispersionThreshold
+            fits = np.where(within, middle, fits)
+            breaks = np.where(within, breaks, middle)
+        last[rows[broken]] = fits
+
+        # unbroken windows that reach the last sample end there, the others go on with the next table
+        rows = rows[~broken & (end < count - 1)]
+        if len(rows):
+            step = 1 << level
+            low = np.minimum(low[:-step], low[step:])
+            high = np.maximum(high[:-step], high[step:])
+            level += 1
+    return last
+
+
+def chainWindows(starts, last):
+    # the windows I-DT keeps going from the left: each one is followed by the first start after its end.
+    # Indices into starts, collected by jumping 1, 2, 4, ... windows ahead from the ones found so far
+    if not len(starts):
+        return np.empty(0, int)
+    jump = np.append(np.searchsorted(starts, last, side='right'), len(starts))
+    chain = np.zeros(1, int)
+    while True:
+        following = jump[chain]
+        following = following[following < len(starts)]
+        if not len(following):
+            return chain
+        chain = np.union1d(chain, following)
+        jump = jump[jump]
+
+
+class DispersionLevels():
+    # I-DT fixations of one set of samples for any dispersion threshold. The windows covering minDuration and
+    # their dispersion are measured once, a level only grows the windows within its threshold and chains them
+    def __init__(self, timestamps, points, minDuration=0.0):
+        self.timestamps, self.points = samples(timestamps, points)
+        count = len(self.timestamps)
+        windowEnd = np.minimum(np.searchsorted(self.timestamps, self.timestamps + minDuration), count - 1)
+        covering = self.timestamps[windowEnd] - self.timestamps >= minDuration
+        self.startDispersion = np.where(covering, windowDispersion(self.points, np.arange(count), windowEnd), np.inf)
+        self.levels = {}
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def fixations(self, threshold):
+        level = self.levels.get(threshold)
+        if level is None:
+            starts = np.flatnonzero(self.startDispersion <= threshold)
+            last = growWindows(self.points, starts, threshold)
+            chain = chainWindows(starts, last)
+            level = self.levels[threshold] = Fixations(self.timestamps, self.points, starts[chain], last[chain])
+        return level
+
+    def precompute(self, thresholds):
+        # every level ahead of time, e.g. from a background thread while the first one is shown
+        for threshold in thresholds:
+            if self.stopped:
+                return
+            self.fixations(threshold)
+
+    def stop(self):
+        self.stopped = True
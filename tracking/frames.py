@@ -0,0 +1,283 @@
+import os
+import re
+import cv2
+import json
+import numpy as np
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Thread
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mkv', '.mov')
+FRAME_NAME = re.compile(r'^(.+)_(\d+)\.(\w+)$')
+# frame folders carry no timing, their frame numbers are timestamps at this rate
+FOLDER_FPS = 30.0
+
+
+class FolderSource():
+    # Frames named prefix_<i>.<ext>, either a whole folder or starting at a chosen frame
+    randomAccess = True
+
+    def __init__(self, path, grayscale=False):
+        self.grayscale = grayscale
+        if os.path.isdir(path):
+            self.folderPath = path
+            names = sorted(name for name in os.listdir(path) if FRAME_NAME.match(name)
+                           and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+            if not names:
+                raise ValueError(f"No prefix_<i> frames found in '{path}'")
+            self.prefix, _, self.fileFormat = FRAME_NAME.match(names[0]).groups()
+            first = 0
+        else:
+            self.folderPath = os.path.dirname(path)
+            match = FRAME_NAME.match(os.path.basename(path))
+            if not match:
+                raise ValueError(f"Frame name '{path}' does not match prefix_<i>.<ext>")
+            self.prefix, first, self.fileFormat = match.groups()
+            first = int(first)
+        # names the recording in the result cache, the same whichever frame the source starts at
+        self.recording = os.path.abspath(os.path.join(self.folderPath, self.prefix))
+
+        numbers = []
+        for name in os.listdir(self.folderPath):
+            match = FRAME_NAME.match(name)
+            if match and match.group(1) == self.prefix and match.group(3) == self.fileFormat and int(match.group(2)) >= first:
+                numbers.append(int(match.group(2)))
+        self.indices = sorted(numbers)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def name(self, i):
+        return self.prefix + "_" + str(i) + "." + self.fileFormat
+
+    def path(self, i):
+        return self.folderPath + "/" + self.name(i)
+
+    def read(self, i):
+        # decode straight to grayscale when nobody draws a color overlay on the frame
+        return cv2.imread(self.path(i), cv2.IMREAD_GRAYSCALE if self.grayscale else cv2.IMREAD_COLOR)
+
+    def frameTask(self, i):
+        # what a detection worker process needs to load frame i by itself
+        return self.path(i)
+
+    def __iter__(self):
+        # yields (index, timestamp, image), the frame number doubles as timestamp
+        for i in self.indices:
+            yield i, i, self.read(i)
+
+
+class VideoSource():
+    # Frames streamed from an eye video, timestamps in seconds taken from the container
+    randomAccess = False
+
+    def __init__(self, path, grayscale=False):
+        self.videoPath = path
+        self.recording = os.path.abspath(path)
+        self.grayscale = grayscale
+        self.prefix = os.path.splitext(os.path.basename(path))[0]
+        self.capture = None
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video '{path}'")
+        self.frameCount = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        capture.release()
+        self.indices = range(self.frameCount)
+
+    def __len__(self):
+        return self.frameCount
+
+    def name(self, i):
+        return self.prefix + "_" + str(i)
+
+    def decode(self, capture):
+        ret, image = capture.read()
+        if not ret:
+            return None
+        if self.grayscale:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    def timestamp(self, capture, i):
+        # position of the decoded frame, containers without timestamps fall back to the frame rate
+        msec = capture.get(cv2.CAP_PROP_POS_MSEC)
+        if msec <= 0 and i > 0:
+            return i / self.fps
+        return msec / 1000
+
+    def read(self, i):
+        # single frames for the previews, seeking is too slow to be used for detection
+        if self.capture is None:
+            self.capture = cv2.VideoCapture(self.videoPath)
+        if self.capture.get(cv2.CAP_PROP_POS_FRAMES) != i:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, i)
+        return self.decode(self.capture)
+
+    def __iter__(self):
+        capture = cv2.VideoCapture(self.videoPath)
+        i = 0
+        try:
+            while True:
+                image = self.decode(capture)
+                if image is None:
+                    break
+                yield i, self.timestamp(capture, i), image
+                i += 1
+        finally:
+            capture.release()
+
+
+class FrameCache():
+    # Decoded grayscale frames of a folder in one memory-mapped uint8 array, rebuilt when a frame file changes
+    randomAccess = True
+
+    def __init__(self, source, cachePath=None):
+        self.source = source
+        cachePath = cachePath or os.path.join(source.folderPath, '.framecache')
+        # named after the first frame, folders opened at a later frame get their own cache
+        base = os.path.join(cachePath, source.name(source.indices[0]))
+        self.arrayPath = base + '.npy'
+        self.indexPath = base + '.json'
+        self.rows = {i: row for row, i in enumerate(source.indices)}
+
+        index = self.fileIndex()
+        if not self.isValid(index):
+            os.makedirs(cachePath, exist_ok=True)
+            self.build(index)
+        self.frames = np.load(self.arrayPath, mmap_mode='c')
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def fileIndex(self):
+        files = []
+        for i in self.source.indices:
+            stat = os.stat(self.source.path(i))
+            files.append([self.source.name(i), stat.st_mtime_ns, stat.st_size])
+        return files
+
+    def isValid(self, index):
+        if not os.path.exists(self.arrayPath) or not os.path.exists(self.indexPath):
+            return False
+        with open(self.indexPath) as f:
+            return json.load(f)["files"] == index
+
+    def build(self, index):
+        first = cv2.imread(self.source.path(self.source.indices[0]), cv2.IMREAD_GRAYSCALE)
+        temporaryPath = self.arrayPath + '.tmp'
+        frames = np.lib.format.open_memmap(temporaryPath, mode='w+', dtype=np.uint8,
+                                           shape=(len(self.source.indices), *first.shape))
+        for row, i in enumerate(self.source.indices):
+            frame = cv2.imread(self.source.path(i), cv2.IMREAD_GRAYSCALE)
+            if frame.shape != first.shape:
+                raise ValueError(f"Frame '{self.source.name(i)}' has a different size than the first frame")
+            frames[row] = frame
+        frames.flush()
+        del frames
+        os.replace(temporaryPath, self.arrayPath)
+        # the index is written last, an interrupted build is never mistaken for a valid cache
+        with open(self.indexPath, 'w') as f:
+            json.dump({"shape": list(first.shape), "files": index}, f)
+
+    def read(self, i):
+        return self.frames[self.rows[i]]
+
+    def frameTask(self, i):
+        return self.arrayPath, self.rows[i]
+
+    def __iter__(self):
+        for i in self.source.indices:
+            yield i, i, self.read(i)
+
+
+class PrefetchSource():
+    # Decodes the next frames in background threads while the current one is being detected
+    def __init__(self, source, depth=8, threads=2):
+        self.source = source
+        self.depth = depth
+        self.threads = threads
+
+    def __len__(self):
+        return len(self.source)
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def __iter__(self):
+        if self.source.randomAccess:
+            yield from self.prefetchFrames()
+        else:
+            yield from self.prefetchStream()
+
+    def prefetchFrames(self):
+        # frames can be read in any order, decode up to depth of them on the thread pool
+        pending = deque()
+        with ThreadPoolExecutor(self.threads) as pool:
+            for i in self.source.indices:
+                pending.append((i, pool.submit(self.source.read, i)))
+                if len(pending) >= self.depth:
+                    i, frame = pending.popleft()
+                    yield i, i, frame.result()
+            while pending:
+                i, frame = pending.popleft()
+                yield i, i, frame.result()
+
+    def prefetchStream(self):
+        # sequential sources are decoded by a single thread into a bounded queue
+        frames = Queue(maxsize=self.depth)
+        stopped = []
+
+        def decode():
+            try:
+                for frame in self.source:
+                    if stopped:
+                        break
+                    frames.put(frame)
+                frames.put(None)
+            except BaseException as error:
+                # ends the stream as well, the consumer raises it instead of stopping as if all frames were read
+                frames.put(error)
+
+        Thread(target=decode, daemon=True).start()
+        finished = False
+        try:
+            while True:
+                frame = frames.get()
+                if isinstance(frame, BaseException):
+                    finished = True
+                    raise frame
+                if frame is None:
+                    finished = True
+                    break
+                yield frame
+        finally:
+            stopped.append(True)
+            # unblock the decoder if it is waiting for space in the queue
+            while not finished:
+                frame = frames.get()
+                finished = frame is None or isinstance(frame, BaseException)
+
+
+def timestampRate(path):
+    # timestamp units per second of the samples detected from a recording, which may no longer exist
+    return 1.0 if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS else FOLDER_FPS
+
+
+def openSource(path, grayscale=False, prefetch=0, cache=False):
+    if os.path.isdir(path) or os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+        source = FolderSource(path, grayscale)
+        if cache:
+            # frames are read straight from the mapped array, there is nothing left to prefetch
+            return FrameCache(source)
+    else:
+        source = VideoSource(path, grayscale)
+    if prefetch:
+        source = PrefetchSource(source, depth=prefetch)
+    return source
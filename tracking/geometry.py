@@ -0,0 +1,194 @@
+import sys
+import numpy as np
+
+from math import sqrt
+
+from scipy.spatial.transform import Rotation
+
+
+class Geometry():
+    def __init__(self):
+        # Constants
+        self.planeNormal = np.array([0, 1, 0])
+        self.planeCenter = np.array([0, -500, 0])
+        self.planeRot = np.array([0, 0, 180])
+
+        # for latest dataset
+        self.cameraPos = np.array([20, -50, -10])
+        self.cameraRotMat = np.array([
+            [0.884918212890625, -0.105633445084095, -0.4536091983318329],
+            [0.4657464325428009, 0.20070354640483856, 0.8618574738502502],
+            [0.0, -0.973940372467041, 0.22680459916591644]
+        ])
+
+        # for synthetizedImages_no_glint_denoised dataset
+        # self.cameraPos = np.array([0, -50, 0])
+        # self.cameraRotMat = np.array([
+        #     [1, 0, 0],
+        #     [0, 0, 1],
+        #     [0, 1, 0]
+        # ])
+
+        self.displaySize = (250, 250) #width, height
+        self.displayPos = np.array([0, -500, 0])
+        self.displayRot = np.array([0, 0, 180])
+        self.displayRotMat = self.eulerToRot(self.displayRot)
+        self.displayNormalLocal = np.array([0, -1, 0])
+        self.displayNormalWorld = self.normalize(self.rotate(self.displayNormalLocal, self.displayRotMat))
+        self.cameraDirsWorld = (
+            self.rotate(np.array((1, 0, 0)), self.cameraRotMat),
+            self.rotate(np.array((0, 1, 0)), self.cameraRotMat),
+            self.rotate(np.array((0, 0, 1)), self.cameraRotMat)
+        )
+
+    def distance(self, p1, p2):
+        return sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
+
+    def dir_vector(self, vec1, vec2):
+        return [vec2[0] - vec1[0], vec2[1] - vec1[1], vec2[2] - vec1[2]]
+
+    def lookAt(self, camera, target, up):
+        forward = target - camera
+        forward = forward / np.linalg.norm(forward)
+
+        right = np.cross(forward, up)
+        right = right / np.linalg.norm(right)
+
+        new_up = np.cross(right, forward)
+
+        result = np.identity(4)
+        result[0][0] = right[0]
+        result[0][1] = right[1]
+        result[0][2] = right[2]
+
+        result[1][0] = new_up[0]
+        result[1][1] = new_up[1]
+        result[1][2] = new_up[2]
+
+        result[2][0] = -forward[0]
+        result[2][1] = -forward[1]
+        result[2][2] = -forward[2]
+
+        translation = np.identity(4)
+        translation[0][3] = -camera[0]
+        translation[1][3] = -camera[1]
+        translation[2][3] = -camera[2]
+
+        lookAt_matrix = np.matmul(result, translation)
+        # Extract the rotation submatrix from the look-at matrix
+        rot_matrix = lookAt_matrix[:3, :3]
+
+        # Convert the rotation to Euler angles using the zxy convention
+        theta_z = np.arctan2(-rot_matrix[0, 1], rot_matrix[0, 0])
+        theta_x = np.arctan2(-rot_matrix[1, 2], rot_matrix[2, 2])
+        theta_y = np.arcsin(rot_matrix[0, 2])
+
+        # Convert the angles to degrees and print the result
+        euler_angles = np.array([theta_x, theta_y, theta_z]) * 180 / np.pi
+
+        return euler_angles
+
+
+    def transform(self, p, position, rotMat):
+        return self.rotate(p, rotMat) + position
+
+    def inverseTransform(self, p, position, rotMat):
+        return (p - position) @ rotMat #inverse rotation
+
+    def rotate(self, p, rotMat):
+        return p @ rotMat.T
+
+    def transfer_vector(self, vec, position, rotation):
+        return vec @ self.eulerToRot(rotation) + position
+
+    def eulerToRot(self, theta, degrees=True) :
+        r = Rotation.from_euler("zxy", (theta[2], theta[0], theta[1]), degrees)
+        return r.as_matrix()
+
+    def intersectPlane(self, n, p0, l0, l):
+        denom = self.matmul(-n, l)
+        if (denom > sys.float_info.min):
+            p0l0 = p0 - l0
+            t = self.matmul(p0l0, -n) / denom
+            return t
+        return -1.0
+
+    def matmul(self, v1, v2, pad=False, padBy=1.0):
+        if(pad is True):
+            return np.matmul(v1, np.append(v2, padBy))[:-1]
+        return np.matmul(v1, v2)
+
+    def getPoint(self, ray, distance):
+        return ray[0] + ray[1] * distance
+
+    def normalize(self, v):
+        return v / self.magnitude(v)
+
+    def magnitude(self, v):
+        return np.sqrt(self.sqrMagnitude(v))
+
+    def sqrMagnitude(self, v):
+        return self.matmul(v, v)
+
+    def lerp(self, a, b, t):
+        return (1 - t) * a + t * b
+
+    def convert_uv_to_px(self, uv_data, width, height):
+        return (int(uv_data[0] * width), int(uv_data[1] * height))
+
+    def convert_to_uv(self, vec, size_x=250, size_y=250, flip_y=True, includeOutliers=False):
+        x = (vec[0] + size_x / 2) / size_x
+        y = (vec[2] + size_y / 2) / size_y
+        if flip_y:
+            y = 1 - y
+
+        if not includeOutliers:
+            if x < 0 or x > 1 or y < 0 or y > 1:
+                return None
+        return (x, y)
+
+    def intersectDisplay(self, result_3d):
+        # camera system to world, returns None when the gaze ray misses the display plane
+        eyePosWorld = self.transform(np.array(result_3d["sphere"]["center"]), self.cameraPos, self.cameraRotMat)
+        gazeRay = self.normalize(self.rotate(result_3d["circle_3d"]["normal"], self.cameraRotMat))
+
+        intersectionTime = self.intersectPlane(self.displayNormalWorld, self.displayPos, eyePosWorld, gazeRay)
+
+        if (intersectionTime > 0.0):
+            return self.getPoint([eyePosWorld, gazeRay], intersectionTime)
+        return None
+
+    def displayToUV(self, planeIntersection):
+        planeIntersection = self.transform(planeIntersection, self.displayPos, self.displayRotMat)
+        return self.convert_to_uv(planeIntersection, includeOutliers=True)
+
+    def intersectPlanes(self, n, p0, origins, directions):
+        # intersectPlane for (N,3) rays, -1 where a ray runs away from the plane
+        denom = directions @ -n
+        hit = denom > sys.float_info.min
+        times = np.full(len(origins), -1.0)
+        times[hit] = ((p0 - origins[hit]) @ -n) / denom[hit]
+        return times
+
+    def pointsToUV(self, points, size_x=250, size_y=250, flip_y=True):
+        # convert_to_uv for (N,3) points, outliers included
+        u = (points[:, 0] + size_x / 2) / size_x
+        v = (points[:, 2] + size_y / 2) / size_y
+        if flip_y:
+            v = 1 - v
+        return np.column_stack((u, v))
+
+    def projectGaze(self, sphereCenters, circleNormals):
+        # (N,3) sphere centers and circle normals in eye camera space -> (N,2) display UV and an outlier mask,
+        # UV is NaN where the gaze ray misses the display plane
+        eyePosWorld = self.transform(np.asarray(sphereCenters, dtype=float).reshape(-1, 3), self.cameraPos, self.cameraRotMat)
+        gazeRays = self.rotate(np.asarray(circleNormals, dtype=float).reshape(-1, 3), self.cameraRotMat)
+        gazeRays /= np.linalg.norm(gazeRays, axis=1, keepdims=True)
+
+        times = self.intersectPlanes(self.displayNormalWorld, self.displayPos, eyePosWorld, gazeRays)
+        hit = times > 0.0
+        planeIntersections = eyePosWorld + gazeRays * times[:, None]
+        uv = self.pointsToUV(self.transform(planeIntersections, self.displayPos, self.displayRotMat))
+        uv[~hit] = np.nan
+        outliers = hit & ((uv < 0) | (uv > 1)).any(axis=1)
+        return uv, outliers
@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+
+def pointHistogram(points, width, height):
+    # gaze points per pixel, points outside the image are dropped
+    points = np.asarray(points).reshape(-1, 2)
+    x = points[:, 0].astype(np.int64)
+    y = points[:, 1].astype(np.int64)
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    pixels = (y * width + x)[inside]
+    return np.bincount(pixels, minlength=width * height).reshape(height, width).astype(np.float32)
+
+
+def blurHistogram(histogram, ngaussian=200, sd=8):
+    radius = ngaussian // 2
+    kernel = cv2.getGaussianKernel(2 * radius + 1, sd, cv2.CV_32F)
+    return cv2.sepFilter2D(histogram, -1, kernel, kernel, borderType=cv2.BORDER_CONSTANT)
+
+
+def coveredPixels(histogram, ngaussian=200):
+    # pixels inside one of the Gaussian squares, the float32 tails underflow to 0 long before the square ends
+    radius = ngaussian // 2
+    return cv2.boxFilter((histogram > 0).astype(np.float32), -1, (ngaussian, ngaussian), anchor=(radius - 1, radius - 1),
+                         normalize=False, borderType=cv2.BORDER_CONSTANT) > 0.5
+
+
+def thresholdDensity(density, covered):
+    # values under the mean of the covered pixels are NaN, i.e. transparent
+    if not covered.any():
+        return np.full(density.shape, np.nan, dtype=np.float32)
+    lowbound = density[covered].mean()
+    density[density < lowbound] = np.nan
+    return density
+
+
+def densityMap(points, width, height, ngaussian=200, sd=8):
+    # Same density as adding a ngaussian x ngaussian Gaussian for every point, computed as a histogram
+    # and a separable blur
+    histogram = pointHistogram(points, width, height)
+    return thresholdDensity(blurHistogram(histogram, ngaussian, sd), coveredPixels(histogram, ngaussian))
+
+
+class HeatmapAccumulator():
+    # densityMap that grows with the samples of a running detection. Small batches add their Gaussians
+    # to the density directly, large ones go through the histogram and the blur
+    def __init__(self, width, height, ngaussian=200, sd=8, batchPoints=1000):
+        self.width = width
+        self.height = height
+        self.ngaussian = ngaussian
+        self.sd = sd
+        self.batchPoints = batchPoints
+        self.radius = ngaussian // 2
+        kernel = cv2.getGaussianKernel(2 * self.radius + 1, sd, cv2.CV_32F)
+        self.kernel = kernel @ kernel.T
+        self.density = np.zeros((height, width), np.float32)
+        self.covered = np.zeros((height, width), bool)
+        self.count = 0
+
+    def add(self, points):
+        points = np.asarray(points).reshape(-1, 2).astype(np.int64)
+        points = points[(points[:, 0] >= 0) & (points[:, 0] < self.width) & (points[:, 1] >= 0) & (points[:, 1] < self.height)]
+        self.count += len(points)
+        if len(points) > self.batchPoints:
+            histogram = pointHistogram(points, self.width, self.height)
+            self.density += blurHistogram(histogram, self.ngaussian, self.sd)
+            self.covered |= coveredPixels(histogram, self.ngaussian)
+            return
+
+        r = self.radius
+        for x, y in points:
+            x0, y0 = max(x - r, 0), max(y - r, 0)
+            x1, y1 = min(x + r + 1, self.width), min(y + r + 1, self.height)
+            self.density[y0:y1, x0:x1] += self.kernel[y0 - y + r:y1 - y + r, x0 - x + r:x1 - x + r]
+            self.covered[y0:min(y + r, self.height), x0:min(x + r, self.width)] = True
+
+    def heatmap(self):
+        return thresholdDensity(self.density.copy(), self.covered)
+
+
+def overlayHeatmap(image, density, alpha=0.5, low=None, high=None):
+    # jet colored density blended onto the BGR image, NaN pixels show the image alone.
+    # The color range defaults to the visible values, tiles of one heatmap pass a shared one
+    visible = ~np.isnan(density)
+    result = image.copy()
+    if not visible.any():
+        return result
+
+    low = density[visible].min() if low is None else low
+    high = density[visible].max() if high is None else high
+    scaled = np.zeros(density.shape, np.uint8)
+    scaled[visible] = np.clip((density[visible] - low) * (255 / max(high - low, 1e-12)), 0, 255).astype(np.uint8)
+    colored = cv2.applyColorMap(scaled, cv2.COLORMAP_JET)
+    np.copyto(result, cv2.addWeighted(colored, alpha, image, 1 - alpha, 0), where=visible[..., None])
+    return result
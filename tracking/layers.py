@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+
+class Layer():
+    # What a drawing changed on top of an image: the pixels it touched and their colors
+    def __init__(self, image, draw, alpha=1.0):
+        canvas = image.copy()
+        draw(canvas)
+        self.alpha = alpha
+        # channel differences summed (saturating) into one plane, nonzero wherever the drawing changed a pixel
+        changed = cv2.findNonZero(cv2.transform(cv2.absdiff(canvas, image), np.ones((1, 3), np.float32)))
+        if changed is None:
+            self.pixels = np.empty(0, np.int64)
+        else:
+            changed = changed.reshape(-1, 2).astype(np.int64)
+            self.pixels = changed[:, 1] * image.shape[1] + changed[:, 0]
+        self.colors = canvas.reshape(-1, 3)[self.pixels]
+
+    def blend(self, image):
+        # in place, only the touched pixels
+        if not len(self.pixels):
+            return image
+        flat = image.reshape(-1, 3)
+        flat[self.pixels] = cv2.addWeighted(self.colors, self.alpha, flat[self.pixels], 1 - self.alpha, 0)
+        return image
+
+
+class LayerCompositor():
+    # Stimulus decoded once with the layers drawn over it kept apart. A layer is only drawn again when the key
+    # of the inputs it was drawn from changes, and the composite only when one of its layers does
+    def __init__(self, image):
+        self.image = image
+        self.layers = {}
+        self.composite = None
+        self.compositeKey = None
+
+    def setLayer(self, name, key, draw, alpha=1.0):
+        if name not in self.layers or self.layers[name][0] != key:
+            self.layers[name] = (key, Layer(self.image, draw, alpha))
+
+    def compose(self, names):
+        # the same as blending every layer, drawn over the stimulus, over the whole frame in turn: a layer also fades
+        # what the layers before it drew. Only the pixels some layer changed can differ from the stimulus
+        key = tuple((name, self.layers[name][0]) for name in names)
+        if key != self.compositeKey:
+            self.composite = self.image.copy()
+            flat, base = self.composite.reshape(-1, 3), self.image.reshape(-1, 3)
+            touched = np.empty(0, np.int64)
+            for name in names:
+                layer = self.layers[name][1]
+                touched = np.union1d(touched, layer.pixels)
+                overlay = base[touched]
+                overlay[np.searchsorted(touched, layer.pixels)] = layer.colors
+                flat[touched] = cv2.addWeighted(overlay, layer.alpha, flat[touched], 1 - layer.alpha, 0)
+            self.compositeKey = key
+        return self.composite
@@ -0,0 +1,274 @@
+import cv2
+import time
+import numpy as np
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pupil_detectors import Detector2D
+from pye3d.detector_3d import CameraModel, Detector3D
+
+from tracking.config import detector2dConfig, detector3dConfig
+from tracking.geometry import Geometry
+from tracking.resultcache import ResultCache, frameKey, loadResults
+from tracking.roi import TRACKING_CHUNK, RoiTracker
+from tracking.timing import StageTimer
+
+SAMPLE_HEADER = ['frame', 'timestamp', 'confidence',
+                 'sphere_x', 'sphere_y', 'sphere_z',
+                 'normal_x', 'normal_y', 'normal_z', 'diameter_3d',
+                 'display_x', 'display_y', 'display_z', 'u', 'v']
+
+
+# Detector2D of the current worker process
+_workerDetector = None
+_workerThreshold = None
+_mappedFrames = {}
+_workerResults = None
+_workerTracker = None
+
+
+def _initWorker(detector_2d_config, threshold_swirski, cachePath=None, tracking=False):
+    global _workerDetector, _workerThreshold, _workerResults, _workerTracker
+    _workerDetector = Detector2D(detector_2d_config)
+    _workerThreshold = threshold_swirski
+    # every worker reads the cached results of the recording by itself
+    _workerResults = None if cachePath is None else loadResults(cachePath)
+    # every worker follows the pupil through the frames it happens to get
+    _workerTracker = RoiTracker(_workerDetector, threshold_swirski) if tracking else None
+
+
+def _workerDetect(grayscale_array):
+    if _workerTracker is None:
+        return _workerDetector.detect(grayscale_array)
+    return _workerTracker.detect(grayscale_array)
+
+
+def _readFrame(frame):
+    # grayscale frame behind a source's frameTask, used by the workers and by replays
+    if isinstance(frame, str):
+        return cv2.imread(frame, cv2.IMREAD_GRAYSCALE)
+    # (cache file, row) of a FrameCache, every process maps the file once
+    arrayPath, row = frame
+    if arrayPath not in _mappedFrames:
+        _mappedFrames[arrayPath] = np.load(arrayPath, mmap_mode='c')
+    return _mappedFrames[arrayPath][row]
+
+
+def _detect2dTask(task):
+    index, timestamp, frame = task
+    # stage timings are sent back to the pipeline's timer
+    timings = []
+    if not isinstance(frame, np.ndarray):
+        start = time.perf_counter()
+        frame = _readFrame(frame)
+        timings.append(('read', time.perf_counter() - start))
+    grayscale_array = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+    # new results are sent back so the main process can add them to its cache
+    start = time.perf_counter()
+    detected = None
+    if _workerResults is None:
+        result_2d = _workerDetect(grayscale_array)
+    else:
+        key = frameKey(grayscale_array)
+        result_2d = _workerResults.get(key)
+        if result_2d is None:
+            result_2d = _workerDetect(grayscale_array)
+            _workerResults[key] = result_2d
+            detected = key, result_2d
+        elif _workerTracker is not None:
+            _workerTracker.update(result_2d)
+        result_2d = dict(result_2d)
+    timings.append(('2D', time.perf_counter() - start))
+
+    # Detector3D only looks at the frame when it has to search for a low confidence pupil
+    if result_2d["confidence"] > _workerThreshold:
+        grayscale_array = None
+    return (index, timestamp, result_2d, grayscale_array), detected, timings
+
+
+def _detect2dChunk(chunk):
+    # consecutive frames, a tracking chunk starts from a whole frame search in any worker
+    if _workerTracker is not None:
+        _workerTracker.reset()
+    return [_detect2dTask(task) for task in chunk]
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class DetectionPipeline(Geometry):
+    # Detector2D -> Detector3D -> display projection, without any GUI
+    def __init__(self, config, workers=1, cache=False, tracking=False):
+        Geometry.__init__(self)
+        self.config = config
+        self.workers = workers
+        self.tracking = tracking
+        self.detector_2d_config = detector2dConfig(config)
+        self.detector_3d_config = detector3dConfig(config)
+        # everything the 2D results depend on, tracked results differ slightly from full frame ones
+        self.detectionKey = dict(self.detector_2d_config, roi_tracking=TRACKING_CHUNK if tracking else 0)
+        self.resultCache = ResultCache(self.detectionKey) if cache else None
+        self.timer = StageTimer()
+        self.resetDetectors()
+
+    def resetDetectors(self):
+        self.detector_2d = Detector2D(self.detector_2d_config)
+        self.tracker = RoiTracker(self.detector_2d, self.detector_3d_config["threshold_swirski"]) if self.tracking else None
+        self.camera = CameraModel(focal_length=self.config['focal_length'], resolution=[640, 480])
+        self.detector_3d = Detector3D(camera=self.camera)
+        self.detector_3d.update_properties(self.detector_3d_config)
+
+    def grayscale(self, image):
+        if image.ndim == 2:
+            return image
+        with self.timer.measure('cvtColor'):
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def detect2d(self, grayscale_array, image=None):
+        with self.timer.measure('2D'):
+            return self.cachedDetect2d(grayscale_array, image)
+
+    def cachedDetect2d(self, grayscale_array, image=None):
+        # the 2D debug view draws on the image, so it always runs the detector
+        if image is not None:
+            return self.detector_2d.detect(grayscale_array, image)
+        if self.resultCache is None:
+            return self.detectPupil(grayscale_array)
+
+        key = frameKey(grayscale_array)
+        result_2d = self.resultCache.get(key)
+        if result_2d is None:
+            result_2d = self.detectPupil(grayscale_array)
+            self.resultCache.add(key, result_2d)
+        elif self.tracker is not None:
+            self.tracker.update(result_2d)
+        return result_2d
+
+    def detectPupil(self, grayscale_array):
+        if self.tracker is None:
+            return self.detector_2d.detect(grayscale_array)
+        return self.tracker.detect(grayscale_array)
+
+    def startPass(self, source):
+        # cached results are loaded per recording, tracking starts over from the first frame
+        if self.resultCache is not None:
+            self.resultCache.open(source.recording)
+        if self.tracker is not None:
+            self.tracker.reset()
+
+    def saveResults(self):
+        if self.resultCache is not None:
+            self.resultCache.save()
+
+    def detect3d(self, result_2d, grayscale_array, timestamp):
+        result_2d["timestamp"] = timestamp
+        with self.timer.measure('3D'):
+            return self.detector_3d.update_and_detect(result_2d, grayscale_array, apply_refraction_correction=False)
+
+    def raycast(self, result_3d):
+        with self.timer.measure('raycast'):
+            return self.intersectDisplay(result_3d)
+
+    def datum(self, index, timestamp, result_2d, grayscale_array, source=None):
+        # 2D result kept for a later replay, Detector3D only needs the frame for low confidence pupils.
+        # Frames of random access sources are read again during the replay, only streamed ones stay in memory
+        if result_2d["confidence"] > self.detector_3d_config["threshold_swirski"]:
+            grayscale_array = None
+        elif source is not None and source.randomAccess:
+            grayscale_array = source.frameTask(index)
+        return index, timestamp, result_2d, grayscale_array
+
+    def process(self, source, datums=None):
+        # single pass over the source, yields (index, timestamp, result_3d, planeIntersection)
+        # the 2D results are appended to datums when a list is passed
+        self.startPass(source)
+        if self.workers > 1:
+            yield from self.processParallel(source, datums)
+            return
+
+        for index, timestamp, image in self.timer.iterate(source):
+            grayscale_array = self.grayscale(image)
+            result_2d = self.detect2d(grayscale_array)
+            if datums is not None:
+                datums.append(self.datum(index, timestamp, result_2d, grayscale_array, source))
+            result_3d = self.detect3d(result_2d, grayscale_array, timestamp)
+            yield index, timestamp, result_3d, self.raycast(result_3d)
+        self.saveResults()
+
+    def replay(self, datums):
+        for datum in datums:
+            yield self.finish3d(*datum)
+
+    def processParallel(self, source, datums=None):
+        # 2D detection is independent per frame and fans out over the worker processes,
+        # the results are collected in frame order because Detector3D has to see them sorted by time
+        if source.randomAccess:
+            tasks = ((i, i, source.frameTask(i)) for i in source.indices)
+        else:
+            tasks = ((i, timestamp, self.grayscale(image)) for i, timestamp, image in self.timer.iterate(source))
+
+        # the workers load the shard from disk, so it has to be up to date
+        cachePath = None
+        if self.resultCache is not None:
+            self.resultCache.save()
+            cachePath = self.resultCache.path
+        pending = deque()
+        with ProcessPoolExecutor(self.workers, initializer=_initWorker,
+                                 initargs=(self.detector_2d_config, self.detector_3d_config["threshold_swirski"],
+                                           cachePath, self.tracking)) as pool:
+            # tracked frames go out in whole tracking chunks, the same ones a single process tracks
+            for chunk in chunked(tasks, TRACKING_CHUNK if self.tracking else 1):
+                pending.append(pool.submit(_detect2dChunk, chunk))
+                # keep a bounded window of frames in flight
+                if len(pending) >= 4 * self.workers:
+                    for result in pending.popleft().result():
+                        yield self.collect(*result, datums, source)
+            while pending:
+                for result in pending.popleft().result():
+                    yield self.collect(*result, datums, source)
+        self.saveResults()
+
+    def collect(self, datum, detected, timings, datums, source):
+        for stage, seconds in timings:
+            self.timer.add(stage, seconds)
+        if detected is not None:
+            self.resultCache.add(*detected)
+        if datums is not None:
+            datums.append(self.datum(*datum, source))
+        return self.finish3d(*datum)
+
+    def finish3d(self, index, timestamp, result_2d, grayscale_array):
+        if grayscale_array is not None and not isinstance(grayscale_array, np.ndarray):
+            with self.timer.measure('read'):
+                grayscale_array = _readFrame(grayscale_array)
+        result_3d = self.detect3d(result_2d, grayscale_array, timestamp)
+        return index, timestamp, result_3d, self.raycast(result_3d)
+
+    def run(self, source, warmup=True):
+        # same two rounds as the main window, the first one only warms up the eye model
+        # and the second one replays its 2D results instead of decoding and detecting again
+        if not warmup:
+            yield from self.process(source)
+            return
+
+        datums = []
+        for _ in self.process(source, datums):
+            pass
+        yield from self.replay(datums)
+
+    def sampleRow(self, index, timestamp, result_3d, planeIntersection):
+        row = [index, timestamp, result_3d["confidence"],
+               *result_3d["sphere"]["center"], *result_3d["circle_3d"]["normal"], result_3d["diameter_3d"]]
+        if planeIntersection is None:
+            return row + [''] * 5
+        return row + [*planeIntersection, *self.displayToUV(planeIntersection)]
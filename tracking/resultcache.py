@@ -0,0 +1,68 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+
+
+def frameKey(grayscale_array):
+    # identical frames get the same key no matter which recording or file they come from
+    digest = hashlib.blake2b(np.ascontiguousarray(grayscale_array), digest_size=16)
+    digest.update(str(grayscale_array.shape).encode())
+    return digest.digest()
+
+
+def loadResults(path):
+    # one shard of a ResultCache, also read by the detection worker processes
+    if path is None or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+class ResultCache():
+    # Detector2D results keyed by frame content, one folder for every detector_2d configuration and one
+    # file in it for every recording, so a run only loads and rewrites the results of its own recording
+    def __init__(self, detector_2d_config, cachePath='.cache/detector_2d'):
+        configKey = hashlib.sha1(json.dumps(detector_2d_config, sort_keys=True).encode()).hexdigest()
+        self.folderPath = os.path.join(cachePath, configKey)
+        self.path = None
+        self.changed = False
+        self.results = {}
+
+    def __len__(self):
+        return len(self.results)
+
+    def shardPath(self, recording):
+        return os.path.join(self.folderPath, hashlib.sha1(recording.encode()).hexdigest() + '.pkl')
+
+    def open(self, recording):
+        # switches to the shard of a recording, the results of the previous one are saved first
+        path = self.shardPath(recording)
+        if path == self.path:
+            return
+        self.save()
+        self.path = path
+        self.results = loadResults(path)
+
+    def get(self, key):
+        # copies, the 3D detector adds a timestamp to the datum it gets
+        result_2d = self.results.get(key)
+        return None if result_2d is None else dict(result_2d)
+
+    def add(self, key, result_2d):
+        self.results[key] = dict(result_2d)
+        self.changed = True
+
+    def save(self):
+        if not self.changed or self.path is None:
+            return
+        os.makedirs(self.folderPath, exist_ok=True)
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'wb') as f:
+            pickle.dump(self.results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryPath, self.path)
+        self.changed = False
@@ -0,0 +1,62 @@
+import numpy as np
+
+# frames after which a tracker forgets the pupil: every pass over a recording splits into the same chunks
+# starting with a whole frame search, so worker processes can track chunks of their own
+TRACKING_CHUNK = 64
+
+
+class RoiTracker():
+    # Detects the pupil in a window around the last confident ellipse,
+    # the whole frame is searched again as soon as the pupil is lost
+    def __init__(self, detector_2d, threshold, scale=0.75, margin=10, chunk=TRACKING_CHUNK):
+        self.detector_2d = detector_2d
+        self.threshold = threshold
+        self.scale = scale
+        self.margin = margin
+        self.chunk = chunk
+        self.reset()
+
+    def reset(self):
+        self.ellipse = None
+        self.frames = 0
+
+    def window(self, shape):
+        x, y = (int(v) for v in self.ellipse["center"])
+        half = int(self.scale * max(self.ellipse["axes"])) + self.margin
+        return max(0, x - half), max(0, y - half), min(shape[1], x + half), min(shape[0], y + half)
+
+    def detect(self, grayscale_array):
+        self.nextFrame()
+        result_2d = None
+        if self.ellipse is not None:
+            x0, y0, x1, y1 = self.window(grayscale_array.shape)
+            result_2d = self.detector_2d.detect(np.ascontiguousarray(grayscale_array[y0:y1, x0:x1]))
+            if result_2d["confidence"] > self.threshold:
+                self.moveResult(result_2d, x0, y0)
+            else:
+                result_2d = None
+
+        if result_2d is None:
+            result_2d = self.detector_2d.detect(grayscale_array)
+        self.follow(result_2d)
+        return result_2d
+
+    def moveResult(self, result_2d, x0, y0):
+        # window coordinates back to the full frame
+        cx, cy = result_2d["ellipse"]["center"]
+        result_2d["ellipse"]["center"] = (cx + x0, cy + y0)
+        x, y = result_2d["location"]
+        result_2d["location"] = (x + x0, y + y0)
+
+    def nextFrame(self):
+        if self.frames % self.chunk == 0:
+            self.ellipse = None
+        self.frames += 1
+
+    def update(self, result_2d):
+        # a result from elsewhere, e.g. the result cache, takes the place of a detected frame
+        self.nextFrame()
+        self.follow(result_2d)
+
+    def follow(self, result_2d):
+        self.ellipse = result_2d["ellipse"] if result_2d["confidence"] > self.threshold else None
@@ -0,0 +1,110 @@
+import numpy as np
+
+# column name -> (shape of one sample, dtype)
+FIELDS = {
+    'frame': ((), np.int64),
+    'timestamp': ((), np.float64),
+    'confidence': ((), np.float64),
+    'sphere': ((3,), np.float64),
+    'circle': ((3,), np.float64),
+    'normal': ((3,), np.float64),
+    'diameter': ((), np.float64),
+    'display': ((3,), np.float64),
+}
+# columns computed from the others, not saved with a session: gaze is the calibrated display UV,
+# NaN without a calibration
+DERIVED = {
+    'gaze': ((2,), np.float64),
+}
+COLUMNS = {**FIELDS, **DERIVED}
+
+
+class GazeSamples():
+    # Per-frame detection results as growable numpy columns instead of one pye3d dict per frame,
+    # display is NaN for frames whose gaze ray misses the display plane
+    def __init__(self, capacity=1024):
+        self.size = 0
+        # bumped by clear(), views that follow the samples as they grow start over when it changes
+        self.generation = 0
+        self.columns = {name: np.empty((capacity, *shape), dtype) for name, (shape, dtype) in COLUMNS.items()}
+
+    def __len__(self):
+        return self.size
+
+    def __getattr__(self, name):
+        if name in COLUMNS:
+            return self.columns[name][:self.size]
+        raise AttributeError(name)
+
+    def __getitem__(self, key):
+        # a column by name, or the samples selected by an index, slice or mask
+        if isinstance(key, str):
+            return getattr(self, key)
+        if isinstance(key, (int, np.integer)):
+            key = [key]
+        return GazeSamples.fromColumns({name: getattr(self, name)[key] for name in COLUMNS})
+
+    @staticmethod
+    def fromColumns(columns):
+        # the columns are used as they are, they only get copied once the samples grow
+        samples = GazeSamples(capacity=0)
+        samples.columns = {name: np.ascontiguousarray(columns[name], dtype) for name, (shape, dtype) in FIELDS.items()}
+        samples.size = len(samples.columns['frame'])
+        for name, (shape, dtype) in DERIVED.items():
+            samples.columns[name] = np.ascontiguousarray(columns[name], dtype) if name in columns else \
+                np.full((samples.size, *shape), np.nan, dtype)
+        return samples
+
+    def reserve(self, capacity):
+        if capacity <= len(self.columns['frame']):
+            return
+        capacity = max(capacity, 2 * len(self.columns['frame']))
+        for name, column in self.columns.items():
+            grown = np.empty((capacity, *column.shape[1:]), column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def append(self, index, timestamp, result_3d, planeIntersection):
+        self.reserve(self.size + 1)
+        row = self.size
+        self.columns['frame'][row] = index
+        self.columns['timestamp'][row] = timestamp
+        self.columns['confidence'][row] = result_3d["confidence"]
+        self.columns['sphere'][row] = result_3d["sphere"]["center"]
+        self.columns['circle'][row] = result_3d["circle_3d"]["center"]
+        self.columns['normal'][row] = result_3d["circle_3d"]["normal"]
+        self.columns['diameter'][row] = result_3d["diameter_3d"]
+        self.columns['display'][row] = np.nan if planeIntersection is None else planeIntersection
+        self.columns['gaze'][row] = np.nan
+        self.size += 1
+
+    def extend(self, columns):
+        count = len(columns['frame'])
+        self.reserve(self.size + count)
+        for name in COLUMNS:
+            self.columns[name][self.size:self.size + count] = columns[name] if name in columns else np.nan
+        self.size += count
+
+    def clear(self):
+        self.size = 0
+        self.generation += 1
+
+    def find(self, frame):
+        # row of a frame number, None when the frame has no result
+        rows = np.flatnonzero(self.frame == frame)
+        return int(rows[0]) if len(rows) else None
+
+    def rows(self, frames):
+        # find for many frames at once, -1 for frames without a result
+        frames = np.asarray(frames, dtype=np.int64).reshape(-1)
+        if not self.size:
+            return np.full(len(frames), -1)
+        order = np.argsort(self.frame, kind='stable')
+        positions = np.minimum(np.searchsorted(self.frame[order], frames), self.size - 1)
+        return np.where(self.frame[order[positions]] == frames, order[positions], -1)
+
+    def sample(self, row):
+        return {name: getattr(self, name)[row] for name in FIELDS}
+
+    def onDisplay(self):
+        return ~np.isnan(self.display[:, 0])
@@ -0,0 +1,102 @@
+import os
+import time
+import msgpack
+import numpy as np
+
+from tracking.calibration import Calibration
+from tracking.samples import FIELDS, GazeSamples
+
+SESSION_EXTENSION = '.session'
+SESSION_VERSION = 1
+
+
+def geometryOf(geometry):
+    # camera and display placement the samples were projected with
+    return {"cameraPos": np.asarray(geometry.cameraPos, dtype=float).tolist(),
+            "cameraRotMat": np.asarray(geometry.cameraRotMat, dtype=float).tolist(),
+            "displaySize": list(geometry.displaySize),
+            "displayPos": np.asarray(geometry.displayPos, dtype=float).tolist(),
+            "displayRot": np.asarray(geometry.displayRot, dtype=float).tolist()}
+
+
+class SessionWriter():
+    # Stream of msgpack records: a header with the config and geometry, then chunks of sample columns.
+    # Chunks are appended to <path>.tmp while the detection runs, it only replaces the session at path
+    # (and its calibrations) once the run is complete, a cancelled or failed run leaves the old one alone
+    def __init__(self, path, config, geometry, source=None, chunkSize=64):
+        self.path = path
+        self.temporaryPath = path + '.tmp'
+        self.chunkSize = chunkSize
+        self.written = 0
+        self.file = open(self.temporaryPath, 'wb')
+        self.writeRecord({"type": "header", "version": SESSION_VERSION, "created": time.time(),
+                          "source": source, "config": config, "geometry": geometryOf(geometry)})
+
+    def writeRecord(self, record):
+        self.file.write(msgpack.packb(record, use_bin_type=True))
+
+    def write(self, samples, flush=False):
+        # samples not written yet, once a whole chunk is collected
+        if len(samples) - self.written < (1 if flush else self.chunkSize):
+            return
+        chunk = {name: np.ascontiguousarray(getattr(samples, name)[self.written:]).tobytes() for name in FIELDS}
+        self.writeRecord(dict(chunk, type="samples", count=len(samples) - self.written))
+        self.written = len(samples)
+        self.file.flush()
+
+    def close(self, samples=None):
+        if self.file.closed:
+            return
+        if samples is not None:
+            self.write(samples, flush=True)
+        self.file.close()
+        os.replace(self.temporaryPath, self.path)
+
+    def discard(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        os.remove(self.temporaryPath)
+
+
+def appendRecord(path, record):
+    # records of a finished session, e.g. a calibration fitted after the detection
+    with open(path, 'ab') as f:
+        f.write(msgpack.packb(record, use_bin_type=True))
+
+
+class Session():
+    def __init__(self, path, header, samples, calibration=None):
+        self.path = path
+        self.version = header["version"]
+        self.created = header["created"]
+        self.source = header["source"]
+        self.config = header["config"]
+        self.geometry = header["geometry"]
+        self.samples = samples
+        self.calibration = calibration
+
+
+def loadSession(path):
+    header = None
+    calibration = None
+    chunks = {name: [] for name in FIELDS}
+    with open(path, 'rb') as f:
+        # a record cut off by a crash ends the stream
+        for record in msgpack.Unpacker(f, raw=False, max_buffer_size=0, read_size=1 << 22):
+            if record["type"] == "header":
+                header = record
+            elif record["type"] == "samples":
+                for name, (shape, dtype) in FIELDS.items():
+                    chunks[name].append(np.frombuffer(record[name], dtype).reshape(record["count"], *shape))
+            elif record["type"] == "calibration":
+                # the last one fitted wins
+                calibration = Calibration.fromRecord(record)
+    if header is None:
+        raise ValueError(f"'{path}' is not a session file")
+    if header["version"] > SESSION_VERSION:
+        raise ValueError(f"'{path}' was saved by a newer version (session format {header['version']})")
+
+    columns = {name: np.concatenate(chunks[name]) if chunks[name] else np.empty((0, *shape), dtype)
+               for name, (shape, dtype) in FIELDS.items()}
+    return Session(path, header, GazeSamples.fromColumns(columns), calibration)
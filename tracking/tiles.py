@@ -0,0 +1,205 @@
+import os
+import cv2
+import hashlib
+import numpy as np
+
+from collections import OrderedDict
+
+from numpy.lib.format import open_memmap
+from PIL import Image
+
+from tracking.heatmap import HeatmapAccumulator, blurHistogram, overlayHeatmap, pointHistogram
+
+TILE_SIZE = 256
+# stimuli with more pixels are drawn from tiles instead of one full resolution heatmap
+TILED_PIXELS = 4096 * 4096
+# the heatmap statistics are taken on the first level with at most this many pixels
+STATS_PIXELS = 2048 * 2048
+# added points take the shared color range again, and redraw every tile, once they grew by this factor since it was taken
+STATS_GROWTH = 1.25
+
+
+def imageSize(imagePath):
+    # (width, height) from the file header without decoding the image, None when Pillow refuses it as too large
+    try:
+        with Image.open(imagePath) as image:
+            return image.size
+    except Image.DecompressionBombError:
+        return None
+
+
+def isLargeImage(imagePath):
+    size = imageSize(imagePath)
+    return size is None or size[0] * size[1] > TILED_PIXELS
+
+
+class StimulusPyramid():
+    # Stimulus decoded once to .npy files, every level half the size of the previous one,
+    # read back through memory maps so only the rows in use are paged in
+    def __init__(self, imagePath, cachePath='.cache/stimulus'):
+        stat = os.stat(imagePath)
+        key = f"{os.path.abspath(imagePath)}:{stat.st_size}:{stat.st_mtime_ns}"
+        self.folder = os.path.join(cachePath, hashlib.sha1(key.encode()).hexdigest())
+        self.imagePath = imagePath
+        self.levels = [self.loadLevel(0)]
+        self.height, self.width = self.levels[0].shape[:2]
+        self.levelCount = 1
+        while max(self.width, self.height) >> self.levelCount > TILE_SIZE // 2:
+            self.levelCount += 1
+
+    def levelPath(self, level):
+        return os.path.join(self.folder, f"level_{level}.npy")
+
+    def loadLevel(self, level):
+        path = self.levelPath(level)
+        if not os.path.exists(path):
+            os.makedirs(self.folder, exist_ok=True)
+            if level == 0:
+                image = cv2.imread(self.imagePath)
+                if image is None:
+                    raise ValueError(f"Cannot read image '{self.imagePath}'")
+                np.save(path + '.tmp.npy', image)
+                del image
+            else:
+                self.buildLevel(self.level(level - 1), path + '.tmp.npy')
+            os.replace(path + '.tmp.npy', path)
+        return np.load(path, mmap_mode='r')
+
+    def buildLevel(self, previous, path, strip=512):
+        # 2x2 area averages, a strip of rows at a time
+        height, width = (previous.shape[0] + 1) // 2, (previous.shape[1] + 1) // 2
+        level = open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+        for row in range(0, previous.shape[0], strip):
+            rows = previous[row:row + strip]
+            level[row // 2:row // 2 + (len(rows) + 1) // 2] = cv2.resize(np.asarray(rows), (width, (len(rows) + 1) // 2),
+                                                                         interpolation=cv2.INTER_AREA)
+        level.flush()
+        del level
+
+    def level(self, level):
+        while len(self.levels) <= level:
+            self.levels.append(self.loadLevel(len(self.levels)))
+        return self.levels[level]
+
+    def levelSize(self, level):
+        width, height = self.width, self.height
+        for _ in range(level):
+            width, height = (width + 1) // 2, (height + 1) // 2
+        return width, height
+
+
+class HeatmapTiles():
+    # Heatmap overlay of a StimulusPyramid rendered per TILE_SIZE tile and pyramid level when a view needs it.
+    # The transparency threshold and the color range are shared by all tiles, so the tiles join seamlessly
+    def __init__(self, pyramid, ngaussian=200, sd=8, alpha=0.5, cacheTiles=256):
+        self.pyramid = pyramid
+        self.ngaussian = ngaussian
+        self.sd = sd
+        self.alpha = alpha
+        self.cacheTiles = cacheTiles
+        self.tiles = OrderedDict()
+        self.setPoints(np.empty((0, 2), np.int64))
+
+    def setPoints(self, points):
+        # level 0 pixels, sorted by row so a tile finds its points with a binary search
+        self.points = np.empty((0, 2), np.int64)
+        self.statsLevel = 0
+        while self.statsLevel < self.pyramid.levelCount - 1 and np.prod(self.pyramid.levelSize(self.statsLevel)) > STATS_PIXELS:
+            self.statsLevel += 1
+        width, height = self.pyramid.levelSize(self.statsLevel)
+        ngaussian, sd = self.levelKernel(self.statsLevel)
+        self.stats = HeatmapAccumulator(width, height, ngaussian, sd)
+        self.statsCount = 0
+        self.lowbound = self.low = self.high = None
+        self.tiles.clear()
+        self.addPoints(points)
+
+    def addPoints(self, points):
+        # merged into the sorted points, only the cached tiles their Gaussians reach are drawn again
+        points = self.inside(points)
+        if not len(points):
+            return
+        points = points[np.argsort(points[:, 1], kind='stable')]
+        self.points = np.insert(self.points, np.searchsorted(self.points[:, 1], points[:, 1], side='right'), points, axis=0)
+        self.stats.add(points >> self.statsLevel)
+        if len(self.points) >= self.statsCount * STATS_GROWTH:
+            self.updateStats()
+            self.tiles.clear()
+            return
+        for key in [key for key in self.tiles if self.reaches(points, *key)]:
+            del self.tiles[key]
+
+    def inside(self, points):
+        points = np.asarray(points).reshape(-1, 2).astype(np.int64)
+        return points[(points[:, 0] >= 0) & (points[:, 0] < self.pyramid.width) &
+                      (points[:, 1] >= 0) & (points[:, 1] < self.pyramid.height)]
+
+    def reaches(self, points, level, tx, ty):
+        radius = self.levelKernel(level)[0] // 2
+        points = points >> level
+        return bool(((points[:, 0] >= tx * TILE_SIZE - radius) & (points[:, 0] < (tx + 1) * TILE_SIZE + radius) &
+                     (points[:, 1] >= ty * TILE_SIZE - radius) & (points[:, 1] < (ty + 1) * TILE_SIZE + radius)).any())
+
+    def levelKernel(self, level):
+        return max(2, self.ngaussian >> level), self.sd / 2 ** level
+
+    def updateStats(self):
+        # threshold and color range in level 0 units, a coarser level has 4x the points per pixel
+        self.statsCount = len(self.points)
+        self.lowbound = self.low = self.high = None
+        if not self.stats.count or not self.stats.covered.any():
+            return
+        scale = 4 ** self.statsLevel
+        self.lowbound = self.stats.density[self.stats.covered].mean() / scale
+        self.low = self.lowbound
+        self.high = self.stats.density.max() / scale
+
+    def tileCount(self, level):
+        width, height = self.pyramid.levelSize(level)
+        return (width + TILE_SIZE - 1) // TILE_SIZE, (height + TILE_SIZE - 1) // TILE_SIZE
+
+    def tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        tile = self.renderTile(level, tx, ty)
+        self.tiles[key] = tile
+        if len(self.tiles) > self.cacheTiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def renderTile(self, level, tx, ty):
+        width, height = self.pyramid.levelSize(level)
+        x0, y0 = tx * TILE_SIZE, ty * TILE_SIZE
+        x1, y1 = min(x0 + TILE_SIZE, width), min(y0 + TILE_SIZE, height)
+        stimulus = np.array(self.pyramid.level(level)[y0:y1, x0:x1])
+        if self.lowbound is None:
+            return stimulus
+
+        # points whose Gaussian reaches into the tile
+        ngaussian, sd = self.levelKernel(level)
+        radius = ngaussian // 2
+        first, last = np.searchsorted(self.points[:, 1], [(y0 - radius) << level, (y1 + radius) << level])
+        points = self.points[first:last] >> level
+        points = points[(points[:, 0] >= x0 - radius) & (points[:, 0] < x1 + radius)]
+        if not len(points):
+            return stimulus
+
+        histogram = pointHistogram(points - (x0 - radius, y0 - radius), x1 - x0 + 2 * radius, y1 - y0 + 2 * radius)
+        density = blurHistogram(histogram, ngaussian, sd)[radius:radius + y1 - y0, radius:radius + x1 - x0]
+        scale = 4 ** level
+        density[density < self.lowbound * scale] = np.nan
+        return overlayHeatmap(stimulus, density, self.alpha, low=self.low * scale, high=self.high * scale)
+
+    def render(self, level, x0, y0, x1, y1):
+        # region of a level in its own pixels, assembled from the tiles it touches
+        region = np.zeros((y1 - y0, x1 - x0, 3), np.uint8)
+        for ty in range(y0 // TILE_SIZE, (y1 - 1) // TILE_SIZE + 1):
+            for tx in range(x0 // TILE_SIZE, (x1 - 1) // TILE_SIZE + 1):
+                tile = self.tile(level, tx, ty)
+                tileX, tileY = tx * TILE_SIZE, ty * TILE_SIZE
+                left, top = max(x0, tileX), max(y0, tileY)
+                right, bottom = min(x1, tileX + tile.shape[1]), min(y1, tileY + tile.shape[0])
+                region[top - y0:bottom - y0, left - x0:right - x0] = tile[top - tileY:bottom - tileY, left - tileX:right - tileX]
+        return region
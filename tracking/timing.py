@@ -0,0 +1,62 @@
+import json
+import time
+import numpy as np
+
+from contextlib import contextmanager
+
+STAGES = ['read', 'cvtColor', '2D', '3D', 'raycast', 'display']
+
+
+class StageTimer():
+    # Latencies of the detection stages in milliseconds, summarized as percentiles
+    def __init__(self):
+        self.samples = {}
+
+    def reset(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds * 1000)
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def iterate(self, iterable, stage='read'):
+        # time spent waiting for every item, e.g. decoding the next frame
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def stages(self):
+        known = [stage for stage in STAGES if stage in self.samples]
+        return known + sorted(stage for stage in list(self.samples) if stage not in STAGES)
+
+    def summary(self):
+        summary = {}
+        for stage in self.stages():
+            samples = np.array(self.samples[stage])
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+            summary[stage] = {"count": len(samples), "mean": float(samples.mean()),
+                              "p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(samples.max())}
+        return summary
+
+    def status(self):
+        lines = [f"{'stage':<9}{'p50':>8}{'p95':>8}{'p99':>8}  ms"]
+        for stage, values in self.summary().items():
+            lines.append(f"{stage:<9}{values['p50']:>8.2f}{values['p95']:>8.2f}{values['p99']:>8.2f}")
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
@@ -177,23 +177,19 @@ if __name__ == "__main__":
     ax = fig.add_subplot(111, projection='3d')
     fig.tight_layout()
 
-    #model warmup
+    #model warmup, keep the 2D results so the second pass does not decode and detect again
+    frames = []
     for i in range(121):
         frame = cv2.imread(os.path.join(img_dir, f"example_{i}.png"))
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         result_2d = detector_2d.detect(gray, frame)
         result_2d["timestamp"] = i
         result_3d = detector_3d.update_and_detect(result_2d, gray)
+        frames.append((frame, gray, result_2d))
     
     gazePointsWorld = []
     #get data
-    for i in range(121):
-        frame = cv2.imread(os.path.join(img_dir, f"example_{i}.png"))
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        result_2d = detector_2d.detect(gray, frame)
-        result_2d["timestamp"] = i
-        
+    for frame, gray, result_2d in frames:
         result_3d = detector_3d.update_and_detect(result_2d, gray, apply_refraction_correction=config["refraction_correction"])
         
         ax.clear()
@@ -1,8 +1,12 @@
 import os
+import sys
 import csv
-import numpy
 from matplotlib import pyplot, image
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracking.heatmap import densityMap
+
 def display(imagefile=None):
     if imagefile != None:
         if not os.path.isfile(imagefile):
@@ -24,65 +28,13 @@ def display(imagefile=None):
 
     return fig, ax
 
-def gaussian(x, sx):
-    xo = x / 2
-    yo = x / 2
-
-    M = numpy.zeros([x, x], dtype=float)
-
-    for i in range(x):
-        for j in range(x):
-            M[j, i] = numpy.exp(
-                -1.0 * (((float(i) - xo) ** 2 / (2 * sx * sx)) + ((float(j) - yo) ** 2 / (2 * sx * sx))))
-
-    return M
-
 def draw_heatmap(gazepoints, dispsize, imagefile=None, alpha=0.5, savefilename=None, gaussianwh=200, gaussiansd=None):
     fig, ax = display(imagefile)
 
     # HEATMAP
-    # Gaussian
     gwh = gaussianwh
     gsdwh = gwh / 6 if (gaussiansd is None) else gaussiansd
-    gaus = gaussian(gwh, gsdwh)
-    # matrix of zeroes
-    strt = gwh // 2
-    heatmapsize = dispsize[1] + 2 * strt, dispsize[0] + 2 * strt
-    heatmap = numpy.zeros(heatmapsize, dtype=float)
-    # create heatmap
-    for i in range(0, len(gazepoints)):
-        # get x and y coordinates
-        x = strt + gazepoints[i][0] - int(gwh / 2)
-        y = strt + gazepoints[i][1] - int(gwh / 2)
-        # correct Gaussian size if either coordinate falls outside of
-        # display boundaries
-        if (not 0 < x < dispsize[0]) or (not 0 < y < dispsize[1]):
-            hadj = [0, gwh];
-            vadj = [0, gwh]
-            if 0 > x:
-                hadj[0] = abs(x)
-                x = 0
-            elif dispsize[0] < x:
-                hadj[1] = gwh - int(x - dispsize[0])
-            if 0 > y:
-                vadj[0] = abs(y)
-                y = 0
-            elif dispsize[1] < y:
-                vadj[1] = gwh - int(y - dispsize[1])
-            # add adjusted Gaussian to the current heatmap
-            try:
-                heatmap[y:y + vadj[1], x:x + hadj[1]] += gaus[vadj[0]:vadj[1], hadj[0]:hadj[1]] * gazepoints[i][2]
-            except:
-                # fixation was probably outside of display
-                pass
-        else:
-            # add Gaussian to the current heatmap
-            heatmap[y:y + gwh, x:x + gwh] += gaus
-    # resize heatmap
-    heatmap = heatmap[strt:dispsize[1] + strt, strt:dispsize[0] + strt]
-    # remove zeros
-    lowbound = numpy.mean(heatmap[heatmap > 0])
-    heatmap[heatmap < lowbound] = numpy.NaN
+    heatmap = densityMap(gazepoints, dispsize[0], dispsize[1], ngaussian=gwh, sd=gsdwh)
     # draw heatmap on top of image
     ax.imshow(heatmap, cmap='jet', alpha=alpha)
 
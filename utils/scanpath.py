@@ -1,9 +1,15 @@
+import os
+import sys
 import csv
 import cv2
 from math import sqrt, atan2, cos, sin
 from matplotlib import pyplot as plt
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracking.fixations import idt
+
 input_path = "./coordinates/uv_coords.csv"
 image_path = "./images/heatmap.jpg"
 
@@ -29,7 +35,6 @@ color2 = (0, 0, 255)
 points_group = {}
 colors = {}
 threshold = 50
-order = 0
 
 with open(input_path) as f:
 	reader = csv.reader(f)
@@ -38,67 +43,22 @@ with open(input_path) as f:
 for i in range(0, len(raw)):
     raw[i] = convert_uv_to_px(raw[i], image_width, image_height)
 
-main_point = None
-for i in range(0, len(raw)):
-    if not main_point:
-        main_point = (raw[i][0], raw[i][1])
-
-    if abs(raw[i][0] - main_point[0]) <= threshold and abs(raw[i][1] - main_point[1]) <= threshold:
-        if not points_group.get(order):
-            points_group[order] = {'points': [raw[i]], 'middle': {'x': 0, 'y': 0}, 'diameter': 0, 'index': order + 1}
-        else:
-            points_group[order]['points'].append(raw[i])
-    
-    else:
-        order += 1
-        main_point = (raw[i][0], raw[i][1])
-        points_group[order] = {'points': [raw[i]], 'middle': {'x': 0, 'y': 0}, 'diameter': 0, 'index': order + 1}
-
-points_group = dict(sorted(points_group.items(), key=lambda item: len(item[1]['points']), reverse=False))
-points_group_keys = list(points_group)    
-
-for key in points_group:
-    points = points_group[key]['points']
-    x = 0
-    y = 0
-    diameter = 0
-
-    for point in points:
-        x += point[0]
-        y += point[1]
-
-    x = int(x / len(points))
-    y = int(y / len(points))
-    points_group[key]['middle']['x'] = x
-    points_group[key]['middle']['y'] = y
-    points_group[key]['diameter'] = 20
-    
-
-different_lengths = {}
-for key in points_group:
-    if not different_lengths.get(len(points_group[key]['points'])):
-        different_lengths[len(points_group[key]['points'])] = [key]
-    else:
-        different_lengths[len(points_group[key]['points'])].append(key)
+# the CSV has no timestamps, the row number stands in for them
+fixations = idt(np.arange(len(raw)), raw, threshold)
+for order in range(len(fixations)):
+    points_group[order] = {'duration': fixations.duration[order],
+                           'middle': {'x': int(fixations.x[order]), 'y': int(fixations.y[order])},
+                           'diameter': 20, 'index': order + 1}
 
 # base pixel for diameter ---- diameter = 20
 # normalize between new_min and new_max ---- normalized_value = ((original_value - min_value) / (max_value - min_value)) * (new_max - new_min) + new_min
 new_min = 1
 new_max = 4
-# normalize between 1 and 2 ---- normalized_value = (value - min_length) / (max_length - min_length) + 1
-
-if len(different_lengths) > 1:
-    max_length = max(different_lengths)
-    min_length = min(different_lengths)
-    for value in different_lengths:
-        normalized_value = ((value - min_length) / (max_length - min_length)) * (new_max - new_min) + new_min
-        for key in different_lengths[value]:
-            points_group[key]['diameter'] = int(20 * normalized_value)
-else:
-    for key in different_lengths:
-        for value in different_lengths[key]:
-            points_group[value]['diameter'] = 20
-        
+
+if len(fixations) and np.ptp(fixations.duration) > 0:
+    normalized = (fixations.duration - fixations.duration.min()) / np.ptp(fixations.duration) * (new_max - new_min) + new_min
+    for order in range(len(fixations)):
+        points_group[order]['diameter'] = int(20 * normalized[order])
 
 points_group = dict(sorted(points_group.items(), key=lambda item: item[1]['index'], reverse=False))
 points_group_keys = list(points_group)